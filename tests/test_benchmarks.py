@@ -0,0 +1,64 @@
+"""
+Parse, roll and render throughput for each backend.
+
+Run with ``pytest tests/test_benchmarks.py --benchmark-only``, and
+compare runs with ``--benchmark-autosave`` / ``--benchmark-compare``.
+"""
+import pytest
+
+from tyche.base import Roll, WoDRoll
+from tyche.dice.generic import Generic
+from tyche.dice.grammar import parse
+from tyche.dice.pbta import PbtA
+from tyche.dice.wod import WoD
+from tyche.pool import DicePool
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [1, 100, 10 ** 4, 10 ** 6]
+
+
+def run(benchmark, function, *args, size=1):
+    # Big pools take long enough per call that a few rounds will do:
+    if size >= 10 ** 4:
+        return benchmark.pedantic(function, args=args, rounds=5, iterations=1)
+    return benchmark(function, *args)
+
+
+@pytest.mark.parametrize("dice", ["3d6+2", "5e8r", "+1"])
+def test_parse(benchmark, dice):
+    benchmark(parse, dice)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_generic_roll(benchmark, size):
+    backend = Generic(DicePool(seed=1))
+    run(benchmark, backend.evaluate, Roll(size, 6, 0), size=size)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_generic_render(benchmark, size):
+    backend = Generic(DicePool(seed=1))
+    result = backend.evaluate(Roll(size, 6, 0))
+    run(benchmark, backend.render, result, size=size)
+
+
+@pytest.mark.parametrize("explode_at", [8, 9, 10])
+@pytest.mark.parametrize("size", SIZES)
+def test_wod_roll(benchmark, size, explode_at):
+    backend = WoD(DicePool(seed=1))
+    context = WoDRoll(size, 10, explode_at, False)
+    run(benchmark, backend.evaluate, context, size=size)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_wod_render(benchmark, size):
+    backend = WoD(DicePool(seed=1))
+    result = backend.evaluate(WoDRoll(size, 10, 10, False))
+    run(benchmark, backend.render, result, size=size)
+
+
+def test_pbta_roll(benchmark):
+    backend = PbtA(DicePool(seed=1))
+    context = Roll(2, 6, 1)
+    benchmark(lambda: backend.render(backend.evaluate(context)))
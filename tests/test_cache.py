@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from tyche.cache import TTLCache
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_per_entry_ttl():
+    cache = TTLCache(ttl=60)
+    cache.set("short", 1, ttl=-1)
+    cache.set("default", 2)
+    assert cache.get("short") is None
+    assert cache.get("default") == 2
+
+
+def test_ttl_for_fetched_values():
+    cache = TTLCache(ttl=60, ttl_for=lambda value: value["ttl"])
+
+    async def fetch():
+        return {"ttl": -1}
+
+    run(cache.get_or_fetch("key", fetch))
+    assert cache.get("key") is None
+
+
+def test_no_last_good_fallback():
+    cache = TTLCache(ttl=60, serve_last_good=False)
+    cache.set("key", "old", ttl=-1)
+
+    async def fail():
+        raise RuntimeError("lookup failed")
+
+    with pytest.raises(RuntimeError):
+        run(cache.get_or_fetch("key", fail))
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+from tyche import api  # noqa: E402
+from tyche.config import DEFAULTS, GuildConfig  # noqa: E402
+from tyche.stub_api import make_app  # noqa: E402
+
+SETTINGS = {
+    1: {"prefix": {"prefix": "!"}, "roles": {"roles": ["red", "blue"]}},
+    2: {"prefix": {"prefix": "?"}},
+    # Missing the "prefix" key, so it can't be decoded:
+    3: {"prefix": {}},
+}
+
+
+def warm(monkeypatch, bulk):
+    async def run():
+        server = TestServer(make_app(SETTINGS, bulk=bulk))
+        await server.start_server()
+        client = api.APIClient(root=str(server.make_url("/api/")))
+        monkeypatch.setattr(api, "api_client", client)
+        config = GuildConfig()
+        try:
+            await config.warm([1, 2, 3])
+            requests = client.requests
+            # As on reconnect:
+            config.invalidate()
+            await config.warm([1, 2, 3])
+            return config, requests, client.requests - requests
+        finally:
+            await client.close()
+            await server.close()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("bulk", [True, False], ids=["bulk", "fallback"])
+def test_warm(monkeypatch, bulk):
+    config, requests, rewarm_requests = warm(monkeypatch, bulk)
+    prefixes = config.caches["prefix"]
+    assert prefixes.get(1) == "!"
+    assert prefixes.get(2) == "?"
+    assert prefixes.get(3) is None
+    assert config.caches["roles"].get(1) == frozenset({"red", "blue"})
+    assert config.caches["roles"].get(2) == DEFAULTS["roles"]
+    if bulk:
+        # One request per endpoint:
+        assert requests == rewarm_requests == 3
+    else:
+        # A bulk request per endpoint, then one per guild:
+        assert requests == 3 + 3 * 3
+        # Having seen the 404s, only the per guild requests:
+        assert rewarm_requests == 3 * 3
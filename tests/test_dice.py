@@ -0,0 +1,166 @@
+import math
+
+import pytest
+
+from tyche.base import Roll, RollResult, WoDRoll
+from tyche.dice import compile_dice
+from tyche.dice import odds
+from tyche.dice.generic import Generic
+from tyche.dice.pbta import PbtA
+from tyche.dice.wod import WoD, explode
+from tyche.errors import ParseError, PoolTooLargeError
+from tyche.pool import DicePool, numpy
+
+SAMPLES = 60000
+POOLS = [False, True] if numpy is not None else [False]
+
+
+def chi_square_critical(df, z=3.09):
+    """
+    The chi-square statistic that df degrees of freedom exceed only 0.1%
+    of the time, by the Wilson-Hilferty approximation.
+    """
+    k = 2 / (9 * df)
+    return df * (1 - k + z * math.sqrt(k)) ** 3
+
+
+def assert_fits(observed, expected):
+    """
+    Chi-square goodness of fit, pooling bins expected to see fewer than
+    five hits into their neighbour.
+    """
+    total = sum(observed)
+    bins = []
+    current_observed = current_expected = 0
+    for o, p in zip(observed, expected):
+        current_observed += o
+        current_expected += p * total
+        if current_expected >= 5:
+            bins.append((current_observed, current_expected))
+            current_observed = current_expected = 0
+    if current_expected:
+        o, e = bins.pop()
+        bins.append((o + current_observed, e + current_expected))
+    statistic = sum((o - e) ** 2 / e for o, e in bins)
+    assert statistic < chi_square_critical(len(bins) - 1)
+
+
+@pytest.fixture(params=POOLS, ids=lambda use_numpy: "numpy" if use_numpy else "python")
+def pool(request):
+    return DicePool(seed=1234, use_numpy=request.param)
+
+
+@pytest.mark.parametrize("dice, expected", [
+    ("3d6+2", ("generic", Roll(3, 6, 2))),
+    ("3d6 - 2", ("generic", Roll(3, 6, -2))),
+    ("d20", ("generic", Roll(1, 20, 0))),
+    ("+2", ("pbta", Roll(2, 6, 2))),
+    ("-1", ("pbta", Roll(2, 6, -1))),
+    ("5", ("wod", WoDRoll(5, 10, 10, False))),
+    ("5e8r", ("wod", WoDRoll(5, 10, 8, True))),
+])
+def test_compile_dice(dice, expected):
+    backend, context = compile_dice(dice)
+    assert (backend.SYSTEM, context) == expected
+
+
+@pytest.mark.parametrize("dice", ["", "abc", "2d0", "3d6+", "5e6", "2d6 fire", "e8"])
+def test_compile_dice__invalid(dice):
+    assert compile_dice(dice) is None
+
+
+def test_compile_dice__too_large():
+    with pytest.raises(PoolTooLargeError):
+        compile_dice("99999999d6")
+
+
+def test_parse__wrong_system():
+    with pytest.raises(ParseError):
+        Generic().parse("+2")
+
+
+def test_generic__fair(pool):
+    backend = Generic(pool)
+    observed = [0] * 6
+    for _ in range(SAMPLES // 100):
+        results = backend.do_roll(Roll(100, 6, 0))
+        assert len(results) == 100
+        for face, count in enumerate(pool.counts(results, 6)):
+            observed[face] += count
+    assert_fits(observed, [1 / 6] * 6)
+
+
+def test_generic__summary_fair(pool):
+    result = Generic(pool).evaluate(Roll(SAMPLES, 20, 0))
+    assert sum(result.face_counts) == SAMPLES
+    assert_fits(result.face_counts, [1 / 20] * 20)
+
+
+def test_generic__render():
+    result = RollResult("generic", Roll(2, 6, 3), dice=[1, 5], total=9)
+    assert result.text == "1, 5 [+3]  (total 9)"
+
+
+def test_generic__evaluate(pool):
+    result = Generic(pool).evaluate(Roll(3, 6, 2))
+    assert result.rolled == 3
+    assert result.total == pool.total(result.dice) + 2
+
+
+def test_pbta__fair(pool):
+    backend = PbtA(pool)
+    context = Roll(2, 6, 0)
+    observed = [0] * 11
+    for _ in range(SAMPLES // 10):
+        observed[pool.total(backend.do_roll(context)) - 2] += 1
+    assert_fits(observed, odds.sum_distribution(2, 6))
+
+
+def test_pbta__evaluate(pool):
+    result = PbtA(pool).evaluate(Roll(2, 6, 1))
+    assert result.tier in ("Miss", "Weak hit", "Strong hit", "Exceptional hit")
+    assert result.text == f"{result.tier} [{result.total}]"
+
+
+@pytest.mark.parametrize("context", [
+    WoDRoll(5, 10, 10, False),
+    WoDRoll(5, 10, 8, False),
+    WoDRoll(5, 10, 9, True),
+])
+def test_wod__fair(pool, context):
+    expected = odds.wod_distribution(*context)
+    observed = [0] * len(expected)
+    for _ in range(SAMPLES // 10):
+        successes = explode(pool, context, keep_dice=False).successes
+        observed[min(successes, len(expected) - 1)] += 1
+    assert_fits(observed, expected)
+
+
+def test_wod__capped(pool):
+    outcome = explode(pool, WoDRoll(100, 10, 7, False), max_dice=110)
+    assert outcome.rolled <= 110
+    assert len(outcome.dice) == outcome.rolled
+
+
+def test_wod__evaluate(pool):
+    result = WoD(pool).evaluate(WoDRoll(3, 10, 10, False))
+    assert result.rolled == len(result.dice)
+    assert result.successes == pool.count_at_least(result.dice, 7)
+    assert result.text.startswith(result.tier)
+
+
+def test_odds__distributions_sum_to_one():
+    assert sum(odds.sum_distribution(10, 6)) == pytest.approx(1)
+    assert sum(odds.wod_distribution(10, 10, 8, True)) == pytest.approx(1)
+
+
+def test_odds__exact_small_distribution():
+    assert odds.sum_distribution(2, 6) == pytest.approx(
+        [n / 36 for n in (1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1)]
+    )
+
+
+def test_odds__limited_by_outcomes():
+    assert odds.within_limits(100, 100)
+    assert not odds.within_limits(200, 1000)
+    assert Generic().odds(Roll(200, 1000, 0)).startswith("Too many dice")
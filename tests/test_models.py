@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("tortoise")
+pytest.importorskip("aiosqlite")
+
+from tortoise import Tortoise  # noqa: E402
+
+from tyche.models import RollHistory, RollRecord  # noqa: E402
+
+
+def record(system, pool, total=None, successes=None):
+    return RollRecord(
+        guild_id=1,
+        user_id=2,
+        created_at=datetime.now(timezone.utc),
+        system=system,
+        dice="",
+        pool=pool,
+        total=total,
+        successes=successes,
+        succeeded=None if successes is None else int(successes > 0),
+    )
+
+
+def test_stats_averages_are_not_truncated():
+    async def run():
+        await Tortoise.init(
+            db_url="sqlite://:memory:",
+            modules={"models": ["tyche.models"]},
+        )
+        await Tortoise.generate_schemas()
+        try:
+            await RollRecord.bulk_create([
+                record("generic", 1, total=3),
+                record("generic", 1, total=4),
+                *(
+                    record("wod", 5, successes=successes)
+                    for successes
+                    in (0, 1, 2, 0)
+                ),
+                record("wod", 3, successes=1),
+            ])
+            history = RollHistory()
+            return (
+                await history.stats(1, 2),
+                await history.wod_stats(1, 2),
+                await history.wod_stats(1, 2, limit=1),
+            )
+        finally:
+            await Tortoise.close_connections()
+
+    stats, wod_stats, top_wod_stats = asyncio.run(run())
+    generic, = [row for row in stats if row["system"] == "generic"]
+    assert generic["rolls"] == 2
+    assert generic["average"] == pytest.approx(3.5)
+    assert [row["pool"] for row in wod_stats] == [3, 5]
+    # Only the most rolled pool size:
+    pool, = top_wod_stats
+    assert pool["pool"] == 5
+    assert pool["average"] == pytest.approx(0.75)
+    assert pool["success_rate"] == pytest.approx(0.5)
@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("discord")
+
+from tyche import ratelimit  # noqa: E402
+
+
+def make_ctx(command_name, invoked_with, guild_id=1, user_id=2):
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id),
+        author=SimpleNamespace(id=user_id),
+        command=SimpleNamespace(
+            name=command_name,
+            aliases=[],
+            qualified_name=command_name,
+        ),
+        invoked_with=invoked_with,
+    )
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = ratelimit.RateLimiter()
+    monkeypatch.setattr(ratelimit, "rate_limiter", limiter)
+    return limiter
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_help_does_not_drain_buckets(limiter):
+    run(ratelimit.check_rate_limit(make_ctx("help", "help")))
+    # Help checks every command it lists against the same context:
+    for name in ("roll", "odds", "play", "clear", "rules") * 10:
+        assert run(ratelimit.check_rate_limit(make_ctx(name, "help")))
+    assert len(limiter.users) == 1
+    assert limiter.guilds._buckets[1][0] == ratelimit.GUILD_RATE_LIMIT_BURST - 1
+
+
+def test_invoked_command_is_charged(limiter):
+    ctx = make_ctx("play", "play")
+    assert run(ratelimit.check_rate_limit(ctx))
+    with pytest.raises(ratelimit.RateLimited):
+        run(ratelimit.check_rate_limit(ctx))
+
+
+@pytest.mark.parametrize("command_name", sorted(ratelimit.COMMAND_COSTS))
+def test_costly_commands_pass_once(command_name):
+    limiter = ratelimit.RateLimiter()
+    assert limiter.acquire(1, 2, command_name)
+
+
+def test_costs_must_fit_guild_bucket():
+    with pytest.raises(ValueError):
+        ratelimit.RateLimiter(costs={"huge": ratelimit.GUILD_RATE_LIMIT_BURST + 1})
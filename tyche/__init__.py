@@ -1 +1,6 @@
-from .core import *  # noqa
+def run():
+    # Imported here so the dice code can be used (and tested) without
+    # discord.py or libopus:
+    from .core import run
+
+    run()
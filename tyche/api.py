@@ -1,31 +1,244 @@
 import os
-import json
+import time
+import random
+import asyncio
 import aiohttp
-from contextlib import AsyncExitStack
+
+from .errors import CircuitOpenError
 
 API_ROOT = os.environ.get("API_ROOT", "http://localhost:8000/api/")
 API_KEY = os.environ.get("API_KEY", "invalid key")
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", 20))
+API_KEEPALIVE = float(os.environ.get("API_KEEPALIVE", 30))
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", 5))
+API_DEADLINE = float(os.environ.get("API_DEADLINE", 8))
+API_RETRIES = int(os.environ.get("API_RETRIES", 2))
+API_BACKOFF = float(os.environ.get("API_BACKOFF", 0.2))
+API_BREAKER_THRESHOLD = int(os.environ.get("API_BREAKER_THRESHOLD", 5))
+API_BREAKER_RESET = float(os.environ.get("API_BREAKER_RESET", 30))
 
 
-async def fetch(url, guild_id):
-    headers = {
-        "Authorization": f"Token {API_KEY}",
-    }
-    params = {
-        "server_id": guild_id,
-    }
-    full_url = f"{API_ROOT}{url}/"
-    async with AsyncExitStack() as stack:
-        session = await stack.enter_async_context(aiohttp.ClientSession())
-        response = await stack.enter_async_context(
-            session.get(full_url, headers=headers, params=params)
+def _is_transient(error):
+    # Client errors (4xx) mean the request itself is wrong, so retrying
+    # won't help and they say nothing about the API's health.
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Fails fast once the API has failed ``threshold`` times in a row.
+
+    After ``reset_timeout`` seconds one trial request is let through
+    (half-open); if it succeeds the breaker closes again, otherwise it
+    stays open for another ``reset_timeout``.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        threshold=API_BREAKER_THRESHOLD,
+        reset_timeout=API_BREAKER_RESET,
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            return True
+        if self.state == self.HALF_OPEN:
+            # Only the one trial request gets through:
+            self.rejected += 1
+            return False
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                print(f"API circuit breaker open after {self.failures} failures")
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def metrics(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class APIClient:
+    """
+    Owns one long-lived ``aiohttp.ClientSession`` for talking to
+    ``API_ROOT``, so that connections are pooled and kept alive between
+    requests rather than set up and torn down per message.
+
+    Each request gets ``deadline`` seconds in total. Transient failures
+    are retried with jittered exponential backoff, and a circuit breaker
+    stops calling the API at all while it is down. Identical concurrent
+    requests share one round trip.
+    """
+
+    def __init__(
+        self,
+        root=API_ROOT,
+        key=API_KEY,
+        pool_size=API_POOL_SIZE,
+        keepalive=API_KEEPALIVE,
+        timeout=API_TIMEOUT,
+        deadline=API_DEADLINE,
+        retries=API_RETRIES,
+        backoff=API_BACKOFF,
+        breaker=None,
+    ):
+        self.root = root
+        self.key = key
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.requests = 0
+        self.retried = 0
+        self.coalesced = 0
+        self._session = None
+        self._inflight = {}
+
+    @property
+    def session(self):
+        # The session has to be created inside the running event loop,
+        # so we build it lazily on first use:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Token {self.key}"},
+            )
+        return self._session
+
+    async def _get_once(self, full_url, params, allow_missing):
+        self.requests += 1
+        async with self.session.get(full_url, params=params) as response:
+            if allow_missing and response.status == 404:
+                return None
+            response.raise_for_status()
+            return await response.text()
+
+    async def _get_with_retries(self, full_url, params, allow_missing):
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Not calling {full_url}, API is down")
+            try:
+                result = await self._get_once(full_url, params, allow_missing)
+            except asyncio.CancelledError:
+                # Out of time (or abandoned), which is as good as a failure:
+                self.breaker.record_failure()
+                raise
+            except Exception as e:
+                if not _is_transient(e):
+                    # The API answered, it just didn't like the request.
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                # Full jitter: sleep anywhere up to the exponential step.
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def get(self, full_url, params, allow_missing=False):
+        return await asyncio.wait_for(
+            self._get_with_retries(full_url, params, allow_missing),
+            timeout=self.deadline,
         )
-        return await response.text()
+
+    async def fetch(self, url, guild_id):
+        key = url, guild_id
+        future = self._inflight.get(key)
+        if future is None:
+            params = {
+                "server_id": guild_id,
+            }
+            full_url = f"{self.root}{url}/"
+            future = asyncio.ensure_future(self.get(full_url, params))
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self._inflight[key] = future
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    async def fetch_many(self, url, guild_ids):
+        """
+        Fetch one endpoint for several guilds in a single request.
+
+        The bulk endpoint answers with a JSON object keyed by server ID.
+        Returns ``None`` if the API doesn't offer a bulk endpoint.
+        """
+        params = [
+            ("server_id", guild_id)
+            for guild_id
+            in guild_ids
+        ]
+        full_url = f"{self.root}{url}/bulk/"
+        return await self.get(full_url, params, allow_missing=True)
+
+    def metrics(self):
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "breaker": self.breaker.metrics(),
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+api_client = APIClient()
+
+
+async def fetch(url, guild_id):
+    return await api_client.fetch(url, guild_id)
+
+
+async def fetch_many(url, guild_ids):
+    return await api_client.fetch_many(url, guild_ids)
+
+
+def metrics():
+    return api_client.metrics()
 
 
-async def get_prefix(bot, message):
-    guild_id = getattr(message.guild, "id", None)
-    if guild_id:
-        payload = await fetch("prefix", guild_id)
-        return json.loads(payload)["prefix"]
-    return ""
+async def close():
+    await api_client.close()
@@ -0,0 +1,218 @@
+import os
+import asyncio
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+import discord
+
+# Tracks played at least AUDIO_CACHE_MIN_PLAYS times are encoded to Opus
+# and kept in AUDIO_CACHE_DIR, least recently played first out once the
+# files add up to more than AUDIO_CACHE_BYTES.
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_BYTES = int(os.environ.get("AUDIO_CACHE_BYTES", 512 * 1024 * 1024))
+AUDIO_CACHE_MIN_PLAYS = int(os.environ.get("AUDIO_CACHE_MIN_PLAYS", 2))
+AUDIO_CACHE_BITRATE = os.environ.get("AUDIO_CACHE_BITRATE", "128k")
+FFMPEG = os.environ.get("FFMPEG", "ffmpeg")
+# Players start at this volume. Cached files are encoded at it, so at the
+# default volume their packets can be sent untouched.
+DEFAULT_VOLUME = float(os.environ.get("DEFAULT_VOLUME", 0.1))
+
+# discord.py reads Opus in 20ms frames:
+FRAME_SECONDS = 0.02
+
+
+class AudioCache:
+    """
+    A size-capped directory of pre-encoded Opus files, so popular tracks
+    aren't downloaded and re-encoded on every play.
+
+    Files are named after a hash of the track's key and the ``gain``
+    they're encoded at. Plays are counted in memory; once a track has
+    been played ``min_plays`` times it's encoded in the background by an
+    ffmpeg subprocess.
+    """
+
+    def __init__(
+        self,
+        directory=AUDIO_CACHE_DIR,
+        max_bytes=AUDIO_CACHE_BYTES,
+        min_plays=AUDIO_CACHE_MIN_PLAYS,
+        gain=DEFAULT_VOLUME,
+    ):
+        self.directory = directory
+        self.gain = gain
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.plays = Counter()
+        self.hits = 0
+        self.misses = 0
+        # {
+        #   [file name]: size in bytes
+        # }, least recently used first
+        self._files = None
+        self._encoding = {}
+
+    def _index(self):
+        if self._files is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".part"):
+                    # Left over from an encode that didn't finish:
+                    os.remove(entry.path)
+                elif entry.name.endswith(".opus"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            self._files = OrderedDict(
+                (name, size)
+                for _, name, size
+                in sorted(entries)
+            )
+        return self._files
+
+    def _name(self, key):
+        # Files encoded at another gain don't match, and age out.
+        return hashlib.sha1(f"{key}|{self.gain}".encode()).hexdigest() + ".opus"
+
+    def total_bytes(self):
+        return sum(self._index().values())
+
+    def get(self, key):
+        """
+        The path of the cached file for ``key``, or ``None``.
+        """
+        name = self._name(key)
+        files = self._index()
+        if name not in files:
+            self.misses += 1
+            return None
+        self.hits += 1
+        files.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        os.utime(path)
+        return path
+
+    def record_play(self, key, stream_url):
+        """
+        Count a play of ``key`` from ``stream_url``, and start encoding it
+        if it's now popular enough.
+        """
+        self.plays[key] += 1
+        name = self._name(key)
+        if (
+            self.plays[key] >= self.min_plays
+            and name not in self._index()
+            and name not in self._encoding
+        ):
+            self._encoding[name] = asyncio.ensure_future(
+                self._encode(name, stream_url)
+            )
+
+    async def _encode(self, name, stream_url):
+        path = os.path.join(self.directory, name)
+        partial = f"{path}.part"
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG, "-nostdin", "-loglevel", "error", "-y",
+                "-reconnect", "1", "-reconnect_streamed", "1",
+                "-i", stream_url, "-vn", "-filter:a", f"volume={self.gain}",
+                "-c:a", "libopus", "-b:a", AUDIO_CACHE_BITRATE,
+                "-ar", "48000", "-ac", "2", "-f", "ogg", partial,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                print(f"Could not cache {name}: {stderr.decode().strip()}")
+                return
+            os.replace(partial, path)
+            self._index()[name] = os.path.getsize(path)
+            self._evict()
+        except Exception as e:
+            print(f"Could not cache {name}: {e!r}")
+        finally:
+            self._encoding.pop(name, None)
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _evict(self):
+        files = self._index()
+        total = sum(files.values())
+        while total > self.max_bytes and files:
+            name, size = files.popitem(last=False)
+            total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            "files": len(self._index()),
+            "bytes": self.total_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "encoding": len(self._encoding),
+        }
+
+
+class CachedOpusSource(discord.AudioSource):
+    """
+    Plays a cached Opus file without decoding it in Python.
+
+    At the ``gain`` the file was encoded at, its packets are passed
+    straight through. At any other volume ffmpeg applies the difference,
+    and changing the volume restarts it from the current position.
+    """
+
+    def __init__(self, path, volume=DEFAULT_VOLUME, gain=DEFAULT_VOLUME):
+        self.path = path
+        self.gain = gain
+        self._volume = volume
+        self._frames = 0
+        self._lock = threading.Lock()
+        self._source = self._open()
+
+    def _open(self):
+        position = self._frames * FRAME_SECONDS
+        before_options = f"-ss {position:.2f}" if position else None
+        if self._volume == self.gain:
+            return discord.FFmpegOpusAudio(
+                self.path, codec="copy", before_options=before_options
+            )
+        return discord.FFmpegOpusAudio(
+            self.path,
+            before_options=before_options,
+            options=f"-filter:a volume={self._volume / self.gain}",
+        )
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        value = max(value, 0.0)
+        if value == self._volume:
+            return
+        with self._lock:
+            self._volume = value
+            old, self._source = self._source, self._open()
+        old.cleanup()
+
+    def read(self):
+        with self._lock:
+            data = self._source.read()
+        if data:
+            self._frames += 1
+        return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._source.cleanup()
+
+
+audio_cache = AudioCache()
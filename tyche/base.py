@@ -1,21 +1,137 @@
 from collections import namedtuple
-from random import randint
+
+from .pool import default_pool
+from .errors import ParseError
 
 
 Roll = namedtuple('Roll', ('number', 'sides', 'modifier'))
+WoDRoll = namedtuple('WoDRoll', ('number', 'sides', 'explode_at', 'is_rote'))
+
+
+class RollResult:
+    """
+    The outcome of one roll, kept as numbers so it can be stored and
+    aggregated cheaply. It is only rendered to text when ``text`` is
+    first read.
+
+    ``dice`` holds the individual dice (as a pool array) when they were
+    kept, and ``face_counts`` how many of each face came up when only
+    that was kept. ``tier`` is the named outcome, for systems with one.
+    """
+
+    __slots__ = (
+        "system",
+        "context",
+        "dice",
+        "face_counts",
+        "rolled",
+        "total",
+        "successes",
+        "botches",
+        "tier",
+        "capped",
+        "_text",
+    )
+
+    def __init__(
+        self,
+        system,
+        context,
+        dice=None,
+        face_counts=None,
+        rolled=0,
+        total=None,
+        successes=None,
+        botches=None,
+        tier=None,
+        capped=False,
+    ):
+        self.system = system
+        self.context = context
+        self.dice = dice
+        self.face_counts = face_counts
+        self.rolled = rolled
+        self.total = total
+        self.successes = successes
+        self.botches = botches
+        self.tier = tier
+        self.capped = capped
+        self._text = None
+
+    @property
+    def modifier(self):
+        return getattr(self.context, "modifier", 0)
+
+    @property
+    def text(self):
+        if self._text is None:
+            # Imported here, as the backends need this module:
+            from .dice import BACKENDS
+
+            self._text = BACKENDS[self.system].render(self)
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return (
+            f"<RollResult {self.system} {self.context} total={self.total} "
+            f"successes={self.successes} tier={self.tier}>"
+        )
 
 
 class Base:
+    # The name the dice grammar uses for this system:
+    SYSTEM = None
+
+    def __init__(self, pool=None):
+        self.pool = pool or default_pool
+
     def parse(self, dice):
+        # Imported here, as the grammar needs the context types above:
+        from .dice.grammar import parse
+
+        parsed = parse(dice)
+        if not parsed or parsed[0] != self.SYSTEM:
+            raise ParseError(f"Invalid dice: {dice}")
+        return parsed[1]
+
+    def render(self, result):
         raise NotImplementedError
 
-    def render(self, results, context):
+    def odds(self, context):
         raise NotImplementedError
 
+    def cost(self, context):
+        """
+        Roughly how much work rolling this will be, in dice.
+        """
+        return context.number
+
+    def odds_cost(self, context):
+        """
+        Roughly how much work working out this roll's odds will be.
+        """
+        from .dice.odds import cost
+
+        return cost(context.number, context.sides)
+
     def do_roll(self, context):
-        return [randint(1, context.sides) for _ in range(context.number)]
+        return self.pool.draw(context.number, context.sides)
+
+    def evaluate(self, context):
+        dice = self.do_roll(context)
+        return RollResult(
+            self.SYSTEM,
+            context,
+            dice=dice,
+            rolled=len(dice),
+            total=self.pool.total(dice) + context.modifier,
+        )
+
+    def roll_parsed(self, context):
+        return self.evaluate(context).text
 
     def roll(self, dice):
-        context = self.parse(dice)
-        results = self.do_roll(context)
-        return self.render(results, context)
+        return self.roll_parsed(self.parse(dice))
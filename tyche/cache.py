@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A small async-aware LRU cache whose entries are fresh for ``ttl``
+    seconds.
+
+    ``get_or_fetch`` deduplicates concurrent misses for the same key, so
+    a burst of lookups shares a single in-flight call to ``fetcher``.
+    For ``stale_ttl`` seconds after an entry goes stale it is still
+    served, while a refresh runs in the background. If a fetch fails, the
+    last good value is served instead, however old it is, unless
+    ``serve_last_good`` is off.
+
+    Entries can have their own TTL, passed to ``set`` or worked out from
+    fetched values by ``ttl_for``.
+    """
+
+    def __init__(
+        self,
+        ttl,
+        maxsize=1024,
+        stale_ttl=0,
+        serve_last_good=True,
+        ttl_for=None,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.serve_last_good = serve_last_good
+        self.ttl_for = ttl_for
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._data = OrderedDict()
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _staleness(self, key):
+        """
+        How long ago ``key`` went stale; negative while it's fresh.
+        """
+        _, expires = self._data[key]
+        return time.monotonic() - expires
+
+    def get(self, key):
+        """
+        Return the fresh value for ``key``, or ``None``.
+        """
+        if key not in self._data or self._staleness(key) > 0:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key][0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = value, time.monotonic() + ttl
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+    async def get_or_fetch(self, key, fetcher):
+        if key in self._data:
+            value, _ = self._data[key]
+            staleness = self._staleness(key)
+            if staleness <= 0:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return value
+            if staleness <= self.stale_ttl:
+                self.stale_hits += 1
+                self._data.move_to_end(key)
+                self._refresh(key, fetcher)
+                return value
+        self.misses += 1
+        return await asyncio.shield(self._refresh(key, fetcher))
+
+    def _refresh(self, key, fetcher):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(key, fetcher))
+            self._inflight[key] = future
+        return future
+
+    async def _fetch(self, key, fetcher):
+        try:
+            value = await fetcher()
+        except Exception:
+            self.errors += 1
+            last_good, _ = self._data.get(key, (_MISSING, None))
+            if last_good is _MISSING or not self.serve_last_good:
+                raise
+            return last_good
+        else:
+            self.set(key, value, self.ttl_for and self.ttl_for(value))
+            return value
+        finally:
+            self._inflight.pop(key, None)
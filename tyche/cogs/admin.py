@@ -1,31 +1,35 @@
 import asyncio
 from collections import defaultdict
 from pathlib import Path
-from discord import Embed, Colour, utils
+from discord import Embed, Colour, HTTPException, utils
 from discord.ext.commands import Cog, command
 from emoji import emojize
 from yaml import safe_load
 
-from ..models import EmojiMessage
+from ..config import guild_config
+from ..models import EmojiMessage, save_emoji_map
+from ..role_index import ROLE_INDEX
 
 
 e = lambda s: emojize(s, use_aliases=True)
 
 MESSAGE_CACHE = {}
 
+ROLE_BATCH_DELAY = 0.5
+
 
 class Admin(Cog):
     def __init__(self, client):
         self.client = client
+        self.messages = defaultdict(dict)
+        self.dispatch_table = {}
+        self._pending_role_changes = {}
 
     def _is_admin(self, member, channel):
         return member.permissions_in(channel).administrator
 
-    def relevant_emoji_change(self, message_id, emoji, user_id, emoji_map) -> bool:
-        right_message = message_id in self.messages.keys()
-        right_emoji = str(emoji) in emoji_map.keys()
-        not_myself = user_id != self.client.user.id
-        return right_message and right_emoji and not_myself
+    def _dispatch_key(self, payload):
+        return payload.message_id, payload.emoji.name
 
     @command(hidden=True)
     async def clear(self, ctx):
@@ -35,6 +39,14 @@ class Admin(Cog):
                     await message.delete()
                     await asyncio.sleep(2)
 
+    @command(hidden=True)
+    async def reload(self, ctx):
+        """
+        Forget cached server settings, e.g. after changing the prefix.
+        """
+        if self._is_admin(ctx.author, ctx.channel):
+            guild_config.invalidate(ctx.guild.id)
+
     async def initialize_message_store(self):
         # {
         #   [message.id]: {
@@ -45,18 +57,23 @@ class Admin(Cog):
         async for message in EmojiMessage.all():
             self.messages[message.message_id][message.emoji] = message.role
 
-        await self.set_all_add_remove_events()
+        self.rebuild_dispatch_table()
 
-    async def update_message_store(self):
-        await EmojiMessage.all().delete()
-        for message_id, emoji_map in self.messages.items():
-            for emoji, role in emoji_map.items():
-                await EmojiMessage.create(message_id=message_id, emoji=emoji, role=role)
+    async def update_message_store(self, message_id, emoji_map):
+        previous = self.messages.get(message_id)
+        await save_emoji_map(message_id, emoji_map, previous)
+        self.messages[message_id] = emoji_map
 
-    async def set_all_add_remove_events(self):
-        for message_id, emoji_map in self.messages.items():
-            self.set_add_remove_events(emoji_map)
-            print(f"Added emoji reaction events for {message_id}")
+    def rebuild_dispatch_table(self):
+        # {
+        #   ([message.id], [emoji]): [role]
+        # }
+        self.dispatch_table = {
+            (message_id, emoji): role
+            for message_id, emoji_map in self.messages.items()
+            for emoji, role in emoji_map.items()
+        }
+        print(f"Watching {len(self.dispatch_table)} emoji reactions")
 
     @command(hidden=True)
     async def rules(self, ctx):
@@ -94,64 +111,58 @@ class Admin(Cog):
             "description": description,
         })
         message = await channel.send(content=None, embed=embed)
-        self.messages[message.id] = emoji_map
-        await self.update_message_store()
+        await self.update_message_store(message.id, emoji_map)
+        self.rebuild_dispatch_table()
         for key in emoji_map.keys():
             await message.add_reaction(key)
 
-        self.set_add_remove_events(emoji_map)
-
-    def set_add_remove_events(self, emoji_map):
-        @self.client.event
-        async def on_raw_reaction_add(payload):
-            guild = self.client.get_guild(payload.guild_id)
-            if not guild:
-                print("Missing guild")
-                return
-            user = await guild.fetch_member(payload.user_id)
-            if not user:
-                print("Missing user")
-                return
-
-            message_id = payload.message_id
-            emoji = payload.emoji.name
-            if self.relevant_emoji_change(message_id, emoji, user.id, emoji_map):
-                await self._add_user_role(
-                    guild,
-                    emoji_map[emoji],
-                    user,
-                )
-
-        @self.client.event
-        async def on_raw_reaction_remove(payload):
-            guild = self.client.get_guild(payload.guild_id)
-            if not guild:
-                print("Missing guild")
-                return
-            user = await guild.fetch_member(payload.user_id)
-            if not user:
-                print("Missing user")
-                return
-
-            message_id = payload.message_id
-            emoji = payload.emoji.name
-            if self.relevant_emoji_change(message_id, emoji, user.id, emoji_map):
-                await self._remove_user_role(
-                    guild,
-                    emoji_map[emoji],
-                    user,
-                )
-
-    async def _add_user_role(self, guild, role_name, user):
-        role = utils.find(
-            lambda r: r.name == role_name,
-            getattr(guild, "roles", []),
-        )
-        role and await user.add_roles(role)
+    @Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        await self._handle_reaction(payload, added=True)
 
-    async def _remove_user_role(self, guild, role_name, user):
-        role = utils.find(
-            lambda r: r.name == role_name,
-            getattr(guild, "roles", []),
-        )
-        role and await user.remove_roles(role)
+    @Cog.listener()
+    async def on_raw_reaction_remove(self, payload):
+        await self._handle_reaction(payload, added=False)
+
+    async def _handle_reaction(self, payload, added):
+        role_name = self.dispatch_table.get(self._dispatch_key(payload))
+        if not role_name or payload.user_id == self.client.user.id:
+            return
+        guild = self.client.get_guild(payload.guild_id)
+        if not guild:
+            print("Missing guild")
+            return
+        role = ROLE_INDEX.get(guild, role_name)
+        if not role:
+            print(f"Missing role {role_name}")
+            return
+        self._queue_role_change(guild, payload.user_id, role, added)
+
+    def _queue_role_change(self, guild, user_id, role, added):
+        """
+        Collect role changes for a member for ``ROLE_BATCH_DELAY``
+        seconds, then apply them. The last reaction change for each role
+        within the window wins, so toggling a reaction costs nothing.
+        """
+        key = guild.id, user_id
+        pending = self._pending_role_changes.get(key)
+        if pending is None:
+            pending = self._pending_role_changes[key] = {}
+            asyncio.ensure_future(self._apply_role_changes(guild, user_id))
+        pending[role.id] = role, added
+
+    async def _apply_role_changes(self, guild, user_id):
+        await asyncio.sleep(ROLE_BATCH_DELAY)
+        pending = self._pending_role_changes.pop((guild.id, user_id))
+        # The role endpoints only need the user's ID, so there's no member
+        # to look up; without the members intent that would mean a REST
+        # fetch_member per batch.
+        http = self.client.http
+        for role, added in pending.values():
+            change = http.add_role if added else http.remove_role
+            try:
+                await change(guild.id, user_id, role.id, reason="Reaction role")
+            except HTTPException as e:
+                # e.g. the role is above ours; carry on with the rest.
+                direction = "add" if added else "remove"
+                print(f"Could not {direction} {role.name} for {user_id}: {e!r}")
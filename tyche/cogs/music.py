@@ -1,71 +1,348 @@
+import os
+import time
 import typing
+import asyncio
+from collections import deque
 from random import choice
+from discord.ext import tasks
 from discord.ext.commands import Cog, command
 
-from ..ytdl import create_ytdl_source
+from ..audio_cache import DEFAULT_VOLUME, audio_cache
+from ..ytdl import (
+    STREAM_URL_MARGIN,
+    create_source,
+    extract_info,
+    is_playlist,
+    iter_playlist,
+    normalize_url,
+    stream_url_expiry,
+)
 from ..constants import AFFIRMATIVES, NEGATIVES
 
+# How many upcoming tracks to extract while the current one plays:
+PREFETCH_TRACKS = int(os.environ.get("PREFETCH_TRACKS", 2))
+# Leave voice after this many seconds with nothing playing, or nobody
+# listening:
+VOICE_IDLE_TIMEOUT = float(os.environ.get("VOICE_IDLE_TIMEOUT", 300))
+VOICE_IDLE_CHECK = min(VOICE_IDLE_TIMEOUT, 30)
 
-# TODO: replace with Redis brain?
-VOICE_CHANNELS = {}
+
+class Track:
+    def __init__(self, url):
+        self.url = url
+        self._extraction = None
+
+    def prefetch(self, loop):
+        if self._extraction is None:
+            self._extraction = asyncio.ensure_future(
+                extract_info(loop, self.url, min_validity=STREAM_URL_MARGIN)
+            )
+
+    async def create_source(self, loop, volume):
+        key = normalize_url(self.url)
+        cached_path = audio_cache.get(key)
+        self.prefetch(loop)
+        ydl, info = await self._extraction
+        if cached_path is None:
+            # Only the stream needs a live URL; cached tracks play from disk.
+            expiry = stream_url_expiry(info)
+            if expiry is not None and expiry - time.time() < STREAM_URL_MARGIN:
+                self._extraction = None
+                self.prefetch(loop)
+                ydl, info = await self._extraction
+            if not info.get("is_live"):
+                audio_cache.record_play(key, info["url"])
+        return create_source(ydl, self.url, info, cached_path, volume)
+
+    def cancel(self):
+        if self._extraction is not None:
+            self._extraction.cancel()
+
+
+class Playlist:
+    """
+    A queued playlist whose entries haven't been listed yet. It's
+    replaced by tracks, a few at a time, as it nears the front of the
+    queue.
+    """
+
+    def __init__(self, loop, url):
+        self.url = url
+        self._entries = iter_playlist(loop, url)
+
+    async def take(self, count):
+        """
+        Up to ``count`` more entry URLs; none once the playlist is done.
+        """
+        urls = []
+        while len(urls) < count:
+            try:
+                urls.append(await self._entries.__anext__())
+            except StopAsyncIteration:
+                break
+        return urls
+
+
+class GuildPlayer:
+    """
+    A guild's playback queue. The next ``PREFETCH_TRACKS`` tracks are
+    extracted in the background, and each track starts from the previous
+    one's ``after`` callback.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.voice = None
+        self.source = None
+        self.volume = DEFAULT_VOLUME
+        self.queue = deque()
+        self.idle_since = None
+        self._filling = asyncio.Lock()
+        self._starting = asyncio.Lock()
+
+    def _prefetch(self):
+        for track in list(self.queue)[:PREFETCH_TRACKS]:
+            if isinstance(track, Track):
+                track.prefetch(self.loop)
+
+    async def _fill(self):
+        # Swap playlists near the front of the queue for their next few
+        # tracks, so there's always something to prefetch and play next.
+        async with self._filling:
+            position = 0
+            while position < min(len(self.queue), PREFETCH_TRACKS + 1):
+                playlist = self.queue[position]
+                if not isinstance(playlist, Playlist):
+                    position += 1
+                    continue
+                try:
+                    urls = await playlist.take(PREFETCH_TRACKS + 1 - position)
+                except Exception as e:
+                    print(f"Could not list {playlist.url}: {e!r}")
+                    urls = []
+                if position >= len(self.queue) or self.queue[position] is not playlist:
+                    # The queue was cleared while we were listing.
+                    break
+                if not urls:
+                    del self.queue[position]
+                for offset, url in enumerate(urls):
+                    self.queue.insert(position + offset, Track(url))
+        self._prefetch()
+
+    def enqueue(self, url):
+        if is_playlist(url):
+            self.queue.append(Playlist(self.loop, url))
+            asyncio.ensure_future(self._fill())
+        else:
+            self.queue.append(Track(url))
+            self._prefetch()
+
+    def is_idle(self):
+        if self.voice is None or not self.voice.is_playing():
+            return True
+        return not any(not member.bot for member in self.voice.channel.members)
+
+    def is_active(self):
+        return self.voice is not None and (
+            self.voice.is_playing() or self.voice.is_paused()
+        )
+
+    async def play_next(self):
+        """
+        Start the next track, unless something's already playing.
+        """
+        # Two ;play commands close together can both get here before
+        # either track has started, so only one may pick a track at once.
+        async with self._starting:
+            while True:
+                await self._fill()
+                if self.is_active():
+                    return
+                connected = self.voice is not None and self.voice.is_connected()
+                if not self.queue or not connected:
+                    self.source = None
+                    return
+                track = self.queue.popleft()
+                self._prefetch()
+                try:
+                    source = await track.create_source(self.loop, self.volume)
+                except Exception as e:
+                    print(f"Could not play {track.url}: {e!r}")
+                    continue
+                if self.is_active():
+                    # Something else started while we were extracting; put
+                    # the track back rather than lose it.
+                    source.cleanup()
+                    self.queue.appendleft(track)
+                    return
+                self.source = source
+                self.voice.play(source, after=self._after)
+                return
+
+    def _after(self, error):
+        # Called from the audio thread when a track ends:
+        if error:
+            print(f"Playback error: {error!r}")
+        asyncio.run_coroutine_threadsafe(self.play_next(), self.loop)
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.source is not None:
+            self.source.volume = volume
+
+    def clear(self):
+        for track in self.queue:
+            if isinstance(track, Track):
+                track.cancel()
+        self.queue.clear()
 
 
 class Music(Cog):
+    def __init__(self):
+        # {
+        #   [guild.id]: GuildPlayer
+        # }
+        self.players = {}
+        self.disconnect_idle.start()
+
+    def cog_unload(self):
+        self.disconnect_idle.cancel()
+
+    def get_player(self, ctx):
+        player = self.players.get(ctx.guild.id)
+        if player is None:
+            player = GuildPlayer(asyncio.get_event_loop())
+            self.players[ctx.guild.id] = player
+        return player
+
+    async def connect(self, ctx, channel):
+        """
+        The guild's player, connected to ``channel``. An existing voice
+        connection is moved rather than reopened.
+        """
+        voice = ctx.voice_client
+        if voice is None:
+            voice = await channel.connect()
+        elif voice.channel != channel:
+            await voice.move_to(channel)
+        player = self.get_player(ctx)
+        player.voice = voice
+        player.idle_since = None
+        return player
+
+    async def close_player(self, guild_id):
+        player = self.players.pop(guild_id, None)
+        if player is None:
+            return
+        player.clear()
+        if player.voice is not None and player.voice.is_connected():
+            await player.voice.disconnect(force=True)
+
+    @tasks.loop(seconds=VOICE_IDLE_CHECK)
+    async def disconnect_idle(self):
+        now = time.monotonic()
+        for guild_id, player in list(self.players.items()):
+            if player.voice is None or not player.voice.is_connected():
+                await self.close_player(guild_id)
+            elif not player.is_idle():
+                player.idle_since = None
+            elif player.idle_since is None:
+                player.idle_since = now
+            elif now - player.idle_since >= VOICE_IDLE_TIMEOUT:
+                print(f"Leaving voice in guild {guild_id} after idling")
+                await self.close_player(guild_id)
+
+    @Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        if member.id == member.guild.me.id and after.channel is None:
+            # We left voice, or were kicked out of it:
+            await self.close_player(member.guild.id)
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild):
+        await self.close_player(guild.id)
+
     @command()
     async def play(self, ctx, url):
         """
-        Play audio from YouTube.
+        Play audio from YouTube, or queue it if something's playing.
         """
-        await ctx.send(choice(AFFIRMATIVES))
-        channel = ctx.message.author.voice.channel
-        if channel:
-            voice = await channel.connect()
-            source = await create_ytdl_source(voice, url)
-            VOICE_CHANNELS[channel.id] = voice, source
-            source.volume = 0.1
-            voice.play(source)
+        voice_state = ctx.message.author.voice
+        if voice_state and voice_state.channel:
+            await ctx.send(choice(AFFIRMATIVES))
+            player = await self.connect(ctx, voice_state.channel)
+            player.enqueue(url)
+            if not player.is_active():
+                await player.play_next()
+        else:
+            await ctx.send(choice(NEGATIVES))
+
+    @command()
+    async def skip(self, ctx):
+        """
+        Skip to the next queued track.
+        """
+        player = self.players.get(ctx.guild.id)
+        if player and player.is_active():
+            await ctx.send(choice(AFFIRMATIVES))
+            # Stopping triggers the after callback, which plays the next:
+            player.voice.stop()
+        else:
+            await ctx.send(choice(NEGATIVES))
+
+    @command()
+    async def queue(self, ctx):
+        """
+        List the queued tracks.
+        """
+        player = self.players.get(ctx.guild.id)
+        if player and player.queue:
+            tracks = "\n".join(
+                f"{position}. <{track.url}>"
+                + (" (playlist)" if isinstance(track, Playlist) else "")
+                for position, track
+                in enumerate(player.queue, start=1)
+            )
+            await ctx.send(f"Up next:\n{tracks}")
+        else:
+            await ctx.send("Nothing queued.")
 
     @command()
     async def pause(self, ctx):
         """
         Pause playing audio.
         """
-        channel = ctx.message.author.voice.channel
-        if channel:
-            voice, _ = VOICE_CHANNELS.get(channel.id)
-            if voice:
-                await ctx.send(choice(AFFIRMATIVES))
-                voice.pause()
-            else:
-                await ctx.send(choice(NEGATIVES))
+        player = self.players.get(ctx.guild.id)
+        if player and player.voice:
+            await ctx.send(choice(AFFIRMATIVES))
+            player.voice.pause()
+        else:
+            await ctx.send(choice(NEGATIVES))
 
     @command()
     async def resume(self, ctx):
         """
         Resume playing audio.
         """
-        channel = ctx.message.author.voice.channel
-        if channel:
-            voice, _ = VOICE_CHANNELS.get(channel.id)
-            if voice:
-                await ctx.send(choice(AFFIRMATIVES))
-                voice.resume()
-            else:
-                await ctx.send(choice(NEGATIVES))
+        player = self.players.get(ctx.guild.id)
+        if player and player.voice:
+            await ctx.send(choice(AFFIRMATIVES))
+            player.voice.resume()
+        else:
+            await ctx.send(choice(NEGATIVES))
 
     @command()
     async def stop(self, ctx):
         """
-        Stop playing audio.
+        Stop playing audio, and clear the queue.
         """
-        channel = ctx.message.author.voice.channel
-        if channel:
-            voice, _ = VOICE_CHANNELS.get(channel.id)
-            if voice:
-                await ctx.send(choice(AFFIRMATIVES))
-                voice.stop()
-            else:
-                await ctx.send(choice(NEGATIVES))
+        player = self.players.get(ctx.guild.id)
+        if player and player.voice:
+            await ctx.send(choice(AFFIRMATIVES))
+            player.clear()
+            player.voice.stop()
+        else:
+            await ctx.send(choice(NEGATIVES))
 
     @command()
     async def vol(self, ctx, volume: typing.Optional[float]):
@@ -74,25 +351,21 @@ class Music(Cog):
 
         Valid values are between 0.0 and 2.0, inclusive.
         """
-        channel = ctx.message.author.voice.channel
-        if channel:
-            _, source = VOICE_CHANNELS.get(channel.id)
-            if source and volume is not None and 0.0 <= volume <= 2.0:
-                await ctx.send(choice(AFFIRMATIVES))
-                source.volume = volume
-            elif source:
-                await ctx.send(f"Currently playing at {source.volume}.")
-            else:
-                await ctx.send(choice(NEGATIVES))
+        player = self.players.get(ctx.guild.id)
+        if player and volume is not None and 0.0 <= volume <= 2.0:
+            await ctx.send(choice(AFFIRMATIVES))
+            player.set_volume(volume)
+        elif player:
+            await ctx.send(f"Currently playing at {player.volume}.")
+        else:
+            await ctx.send(choice(NEGATIVES))
 
     @command()
     async def leave(self, ctx):
         """
         Leave the current user's voice channel.
         """
-        channel = ctx.message.author.voice.channel
-        if channel:
-            voice, _ = VOICE_CHANNELS.get(channel.id)
-            if voice:
-                await voice.disconnect()
-                VOICE_CHANNELS.pop(channel.id)
+        if ctx.guild.id in self.players:
+            await self.close_player(ctx.guild.id)
+        elif ctx.voice_client is not None:
+            await ctx.voice_client.disconnect()
@@ -1,35 +1,47 @@
 from random import choice
 from discord.ext.commands import Cog, command
 
-from ..api import fetch
+from ..config import guild_config
 from ..constants import AFFIRMATIVES, NEGATIVES
+from ..role_index import ROLE_INDEX
 
 
 async def is_acceptable(role_name, context):
-    guild_acceptable_roles = await fetch("roles", context.message.guild.id)
-    acceptable_roles = [
-        r
-        for r in context.message.guild.roles
-        if r.name in guild_acceptable_roles
-    ]
-    try:
-        return next(r for r in acceptable_roles if r.name == role_name)
-    except StopIteration:
-        return None
+    guild = context.message.guild
+    guild_acceptable_roles = await guild_config.roles(guild.id)
+    return ROLE_INDEX.get_acceptable(guild, role_name, guild_acceptable_roles)
 
 
 class Roles(Cog):
+    @Cog.listener()
+    async def on_guild_role_create(self, role):
+        ROLE_INDEX.invalidate(role.guild)
+
+    @Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        if before.name != after.name:
+            ROLE_INDEX.invalidate(after.guild)
+
+    @Cog.listener()
+    async def on_guild_role_delete(self, role):
+        ROLE_INDEX.invalidate(role.guild)
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild):
+        ROLE_INDEX.invalidate(guild)
+
     @command()
     async def list(self, ctx):
         """
         List all cosmetic roles on the current server.
         """
-        guild_acceptable_roles = await fetch("roles", ctx.message.guild.id)
-        acceptable_roles = ", ".join(sorted(
-            f"`{r.name}`"
-            for r in ctx.message.guild.roles
-            if r.name in guild_acceptable_roles
-        ))
+        guild = ctx.message.guild
+        guild_acceptable_roles = await guild_config.roles(guild.id)
+        acceptable_roles = ", ".join(
+            f"`{name}`"
+            for name
+            in ROLE_INDEX.acceptable_names(guild, guild_acceptable_roles)
+        )
         message = f"I can add or remove these roles from you: {acceptable_roles}"
         await ctx.send(message)
 
@@ -1,15 +1,29 @@
 from discord.ext.commands import Cog, command
 
 
-from ..errors import ParseError
-from ..dice.generic import Generic
-from ..dice.pbta import PbtA
-from ..dice.wod import WoD
-
-BACKENDS = [Generic(), WoD(), PbtA()]
+from ..dice import compile_dice, odds
+from ..dice.executor import roll_executor
+from ..dice.generic import MESSAGE_LIMIT
+from ..errors import PoolTooLargeError, RollQueueFullError
+from ..models import roll_history
 
 
 class Rolls(Cog):
+    def __init__(self):
+        odds.precompute()
+
+    def _format_record(self, record):
+        if record.successes is not None:
+            return f"{record.tier} [{record.successes}]"
+        if record.tier:
+            return f"{record.tier} [{record.total}]"
+        return f"total {record.total}"
+
+    @Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        # Don't bother finishing a roll nobody is waiting for:
+        roll_executor.cancel(payload.message_id)
+
     @command()
     async def roll(self, ctx, *dice):
         """
@@ -19,13 +33,90 @@ class Rolls(Cog):
         X(eY)(r)   Chronicles of Darkness roller
         +/-X       Powered by the Apocalypse roller
         """
-        result = ""
-        for backend in BACKENDS:
+        try:
+            compiled = compile_dice(" ".join(dice))
+        except PoolTooLargeError as e:
+            await ctx.send(str(e))
+            return
+        if compiled:
+            backend, context = compiled
+            guild_id = getattr(ctx.guild, "id", None)
             try:
-                result = backend.roll(" ".join(dice))
-                if result:
-                    await ctx.send(result)
-                    return
-            except ParseError:
-                pass
+                result = await roll_executor.roll(
+                    backend,
+                    context,
+                    guild_id=guild_id,
+                    message_id=ctx.message.id,
+                )
+            except RollQueueFullError as e:
+                await ctx.send(str(e))
+                return
+            roll_history.record(guild_id, ctx.author.id, " ".join(dice), result)
+            await ctx.send(result.text)
 
+    @command()
+    async def odds(self, ctx, *dice):
+        """
+        Work out the odds of a roll, without rolling it.
+
+        Takes the same dice as roll.
+        """
+        try:
+            compiled = compile_dice(" ".join(dice))
+        except PoolTooLargeError as e:
+            await ctx.send(str(e))
+            return
+        if compiled:
+            backend, context = compiled
+            try:
+                text = await roll_executor.odds(
+                    backend,
+                    context,
+                    guild_id=getattr(ctx.guild, "id", None),
+                    message_id=ctx.message.id,
+                )
+            except RollQueueFullError as e:
+                await ctx.send(str(e))
+                return
+            await ctx.send(text)
+
+    @command()
+    async def history(self, ctx):
+        """
+        Show your last few rolls on this server.
+        """
+        records = await roll_history.recent(
+            getattr(ctx.guild, "id", None),
+            ctx.author.id,
+        )
+        lines = [
+            f"`{record.dice}`: {self._format_record(record)}"
+            for record
+            in records
+        ]
+        await ctx.send("\n".join(lines) or "You haven't rolled anything yet.")
+
+    @command()
+    async def stats(self, ctx):
+        """
+        Show your rolling stats on this server.
+        """
+        guild_id = getattr(ctx.guild, "id", None)
+        lines = []
+        for row in await roll_history.stats(guild_id, ctx.author.id):
+            if row["system"] == "wod":
+                continue
+            lines.append(
+                f"{row['system']}: {row['rolls']} rolls, "
+                f"average total {row['average'] or 0:.2f}"
+            )
+        for row in await roll_history.wod_stats(guild_id, ctx.author.id):
+            lines.append(
+                f"{row['pool']} dice: {row['rolls']} rolls, "
+                f"average {row['average'] or 0:.2f} successes, "
+                f"{row['success_rate'] or 0:.0%} succeeded"
+            )
+        message = "\n".join(lines) or "You haven't rolled anything yet."
+        if len(message) > MESSAGE_LIMIT:
+            message = message[:MESSAGE_LIMIT].rsplit("\n", 1)[0]
+        await ctx.send(message)
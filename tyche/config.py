@@ -0,0 +1,181 @@
+import os
+import json
+import asyncio
+from collections import namedtuple
+
+from .api import fetch, fetch_many
+from .cache import TTLCache
+
+CONFIG_CACHE_TTL = float(os.environ.get("CONFIG_CACHE_TTL", 300))
+CONFIG_CACHE_STALE_TTL = float(os.environ.get("CONFIG_CACHE_STALE_TTL", 3600))
+CONFIG_CACHE_SIZE = int(os.environ.get("CONFIG_CACHE_SIZE", 4096))
+DEFAULT_PREFIX = os.environ.get("DEFAULT_PREFIX", ";")
+WARMUP_BATCH_SIZE = int(os.environ.get("WARMUP_BATCH_SIZE", 50))
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", 4))
+
+
+StreamingRole = namedtuple("StreamingRole", ("name", "requires"))
+
+
+def _decode_prefix(payload):
+    return payload["prefix"]
+
+
+def _decode_roles(payload):
+    if isinstance(payload, dict):
+        payload = payload.get("roles", [])
+    return frozenset(
+        r["name"] if isinstance(r, dict) else r
+        for r
+        in payload
+    )
+
+
+def _decode_streaming_role(payload):
+    return StreamingRole(
+        payload["streaming_role"],
+        payload["streaming_role_requires"],
+    )
+
+
+DECODERS = {
+    "prefix": _decode_prefix,
+    "roles": _decode_roles,
+    "streaming_role": _decode_streaming_role,
+}
+
+# Served when the API is unreachable and we have nothing cached:
+DEFAULTS = {
+    "prefix": DEFAULT_PREFIX,
+    "roles": frozenset(),
+    "streaming_role": StreamingRole(None, None),
+}
+
+
+class GuildConfig:
+    """
+    Per-guild settings from the API, decoded and cached per endpoint.
+
+    Reads are served from memory; stale entries are refreshed in the
+    background, and the last good value is served while the API is down.
+    With no good value to fall back on, ``DEFAULTS`` are served.
+    """
+
+    def __init__(
+        self,
+        ttl=CONFIG_CACHE_TTL,
+        stale_ttl=CONFIG_CACHE_STALE_TTL,
+        maxsize=CONFIG_CACHE_SIZE,
+    ):
+        self.caches = {
+            endpoint: TTLCache(ttl=ttl, stale_ttl=stale_ttl, maxsize=maxsize)
+            for endpoint
+            in DECODERS
+        }
+        # Endpoints the API turned out not to have a bulk route for:
+        self.no_bulk = set()
+
+    async def _load(self, endpoint, guild_id):
+        payload = await fetch(endpoint, guild_id)
+        return DECODERS[endpoint](json.loads(payload))
+
+    async def get(self, endpoint, guild_id):
+        try:
+            return await self.caches[endpoint].get_or_fetch(
+                guild_id,
+                lambda: self._load(endpoint, guild_id),
+            )
+        except Exception as e:
+            print(f"Using default {endpoint} for {guild_id}: {e!r}")
+            return DEFAULTS[endpoint]
+
+    async def prefix(self, guild_id) -> str:
+        return await self.get("prefix", guild_id)
+
+    async def roles(self, guild_id) -> frozenset:
+        return await self.get("roles", guild_id)
+
+    async def streaming_role(self, guild_id) -> StreamingRole:
+        return await self.get("streaming_role", guild_id)
+
+    async def _warm_batch(self, endpoint, guild_ids, semaphore):
+        payload = None
+        if endpoint not in self.no_bulk:
+            async with semaphore:
+                try:
+                    payload = await fetch_many(endpoint, guild_ids)
+                except Exception as e:
+                    print(
+                        f"Could not warm {endpoint} for {len(guild_ids)} "
+                        f"guilds: {e}"
+                    )
+                    return
+            if payload is None:
+                # Don't ask again for later batches, or on reconnect:
+                self.no_bulk.add(endpoint)
+        if payload is None:
+            # No bulk endpoint, so fall back to one request per guild:
+            for guild_id in guild_ids:
+                async with semaphore:
+                    await self.get(endpoint, guild_id)
+            return
+        try:
+            payloads = json.loads(payload)
+        except ValueError as e:
+            print(f"Could not warm {endpoint} for {len(guild_ids)} guilds: {e}")
+            return
+        decode = DECODERS[endpoint]
+        for guild_id, guild_payload in payloads.items():
+            # One bad guild shouldn't stop the rest from warming:
+            try:
+                value = decode(guild_payload)
+                guild_id = int(guild_id)
+            except Exception as e:
+                print(f"Could not warm {endpoint} for {guild_id}: {e!r}")
+                continue
+            self.caches[endpoint].set(guild_id, value)
+
+    async def warm(
+        self,
+        guild_ids,
+        batch_size=WARMUP_BATCH_SIZE,
+        concurrency=WARMUP_CONCURRENCY,
+    ):
+        """
+        Load every endpoint for ``guild_ids`` ahead of the first message,
+        ``batch_size`` guilds per request and at most ``concurrency``
+        requests at once.
+        """
+        guild_ids = list(guild_ids)
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(
+            self._warm_batch(endpoint, guild_ids[i:i + batch_size], semaphore)
+            for endpoint in DECODERS
+            for i in range(0, len(guild_ids), batch_size)
+        ))
+
+    def invalidate(self, guild_id=None, endpoint=None):
+        """
+        Drop cached settings for a guild (or every guild), for one
+        endpoint or all of them.
+        """
+        endpoints = [endpoint] if endpoint else self.caches.keys()
+        for name in endpoints:
+            self.caches[name].invalidate(guild_id)
+
+    def stats(self):
+        return {
+            endpoint: cache.stats()
+            for endpoint, cache
+            in self.caches.items()
+        }
+
+
+guild_config = GuildConfig()
+
+
+async def get_prefix(bot, message):
+    guild_id = getattr(message.guild, "id", None)
+    if guild_id:
+        return await guild_config.prefix(guild_id)
+    return ""
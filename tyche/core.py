@@ -1,11 +1,18 @@
-import json
 import os
 
 import discord
-from discord.ext.commands import Bot, Cog, command
-
-from .api import fetch, get_prefix, API_ROOT
-from .models import init as db_init
+from discord.ext import tasks
+from discord.ext.commands import AutoShardedBot, Bot, Cog, command
+
+from .api import API_ROOT, close as api_close, metrics as api_metrics
+from .audio_cache import audio_cache
+from .config import get_prefix, guild_config
+from .dice.executor import roll_executor
+from .models import init as db_init, close as db_close, roll_history
+from .ratelimit import RateLimited, check_rate_limit
+from .role_index import ROLE_INDEX
+from .shards import shard_stats
+from .ytdl import extractor
 from .cogs.music import Music
 from .cogs.roles import Roles
 from .cogs.rolls import Rolls
@@ -18,9 +25,56 @@ if not discord.opus.is_loaded():
     discord.opus.load_opus(os.environ.get("LIBOPUS", default))
 
 
+# To split the gateway across processes or hosts, give each one the same
+# SHARD_COUNT and its own comma-separated SHARD_IDS.
+SHARD_COUNT = os.environ.get("SHARD_COUNT")
+SHARD_IDS = os.environ.get("SHARD_IDS")
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", 300))
+
+
+class TycheMixin:
+    def dispatch(self, event_name, *args, **kwargs):
+        shard_stats.record(self, args)
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def close(self):
+        # Release pooled connections and workers along with the gateway:
+        await api_close()
+        await roll_history.flush()
+        await db_close()
+        roll_executor.shutdown()
+        extractor.shutdown()
+        await super().close()
+
+
+class Tyche(TycheMixin, Bot):
+    pass
+
+
+class ShardedTyche(TycheMixin, AutoShardedBot):
+    pass
+
+
+def make_client(**kwargs):
+    if SHARD_IDS and not SHARD_COUNT:
+        # discord.py can't tell which shards to run without the total:
+        raise RuntimeError("SHARD_IDS is set, so SHARD_COUNT must be too")
+    if SHARD_COUNT:
+        return ShardedTyche(
+            shard_count=int(SHARD_COUNT),
+            shard_ids=[
+                int(shard_id)
+                for shard_id
+                in SHARD_IDS.split(",")
+            ] if SHARD_IDS else None,
+            **kwargs,
+        )
+    return Tyche(**kwargs)
+
+
 # Ready Bot One!
 
-client = Bot(description="Tyche, the diceroller", command_prefix=get_prefix)
+client = make_client(description="Tyche, the diceroller", command_prefix=get_prefix)
 
 # Set up cogs:
 client.add_cog(Music())
@@ -31,14 +85,31 @@ admin_cog = Admin(client)
 client.add_cog(admin_cog)
 
 
+@tasks.loop(seconds=STATS_INTERVAL)
+async def log_stats():
+    shard_stats.report(client)
+    print(f"API: {api_metrics()}")
+    print(f"Guild config cache: {guild_config.stats()}")
+    print(f"Extraction cache: {extractor.stats()}")
+    print(f"Audio cache: {audio_cache.stats()}")
+
+
 @client.event
 async def on_ready():
     await db_init()
     await admin_cog.initialize_message_store()
+    await guild_config.warm(guild.id for guild in client.guilds)
     print(
         f"Logged in as {client.user.name} (ID:{client.user.id}) | "
         f"Connected to {str(len(client.guilds))} guilds"
     )
+    if client.shard_count:
+        shard_ids = getattr(client, "shard_ids", None) or "all"
+        print(f"Running shards {shard_ids} of {client.shard_count}")
+    if not log_stats.is_running():
+        log_stats.start()
+    else:
+        shard_stats.report(client)
     print(f"Communicating with {API_ROOT}")
     print("--------")
     print(f"Current Discord.py Version: {discord.__version__}")
@@ -75,17 +146,11 @@ async def on_member_update(before, after):
     if not change_in_streaming:
         return
 
-    response = await fetch("streaming_role", after.guild.id)
-    response = json.loads(response)
-    streaming_role_name = response["streaming_role"]
-    streaming_role_requires = response["streaming_role_requires"]
+    streaming_role_name, streaming_role_requires = (
+        await guild_config.streaming_role(after.guild.id)
+    )
     if streaming_role_name:
-        avilable_roles = {
-            r.name: r
-            for r
-            in after.guild.roles
-        }
-        streaming_role = avilable_roles.get(streaming_role_name, None)
+        streaming_role = ROLE_INDEX.get(after.guild, streaming_role_name)
         if not streaming_role:
             # Bail early if role missing:
             return
@@ -102,6 +167,18 @@ async def on_member_update(before, after):
             await after.add_roles(streaming_role)
 
 
+client.add_check(check_rate_limit)
+
+
+@client.event
+async def on_command_error(ctx, error):
+    # Replying to someone who is spamming would only spend more of our
+    # Discord rate limit, so rate-limited commands are dropped quietly:
+    if isinstance(error, RateLimited):
+        return
+    await Bot.on_command_error(client, ctx, error)
+
+
 @client.command()
 async def ping(ctx):
     """
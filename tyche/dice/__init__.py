@@ -0,0 +1,39 @@
+import os
+from functools import lru_cache
+
+from .generic import Generic
+from .grammar import parse
+from .pbta import PbtA
+from ..pool import MAX_DICE, MAX_SIDES, within_limits
+from ..errors import PoolTooLargeError
+from .wod import WoD
+
+DICE_CACHE_SIZE = int(os.environ.get("DICE_CACHE_SIZE", 1024))
+
+BACKENDS = {
+    backend.SYSTEM: backend
+    for backend
+    in (Generic(), WoD(), PbtA())
+}
+
+
+@lru_cache(maxsize=DICE_CACHE_SIZE)
+def compile_dice(dice):
+    """
+    Parse dice once and pair the context with the backend that rolls it.
+
+    Returns a ``(backend, context)`` pair, or ``None`` if the dice aren't
+    valid in any system. Both are immutable, so results are cached by the
+    input string and repeated rolls skip parsing entirely. Raises
+    ``PoolTooLargeError`` for more than ``MAX_DICE`` dice or
+    ``MAX_SIDES`` sides.
+    """
+    parsed = parse(dice)
+    if not parsed:
+        return None
+    system, context = parsed
+    if not within_limits(context):
+        raise PoolTooLargeError(
+            f"Too many dice: at most {MAX_DICE} dice of {MAX_SIDES} sides"
+        )
+    return BACKENDS[system], context
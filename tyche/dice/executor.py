@@ -0,0 +1,141 @@
+import os
+import asyncio
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from ..errors import RollQueueFullError
+from ..pool import default_pool
+
+# Rolls estimated to cost less than this run inline on the event loop:
+ROLL_OFFLOAD_COST = int(os.environ.get("ROLL_OFFLOAD_COST", 10000))
+# Odds that take more steps than this to work out go to the pool too:
+ODDS_OFFLOAD_COST = int(os.environ.get("ODDS_OFFLOAD_COST", 100000))
+ROLL_WORKERS = int(os.environ.get("ROLL_WORKERS", 2))
+# Per guild: how many rolls may run at once, and how many may wait.
+ROLL_GUILD_CONCURRENCY = int(os.environ.get("ROLL_GUILD_CONCURRENCY", 1))
+ROLL_GUILD_QUEUE = int(os.environ.get("ROLL_GUILD_QUEUE", 3))
+
+
+def _start_worker():
+    # Forked workers inherit the parent's generator state, so without this
+    # every worker would roll the same numbers.
+    default_pool.reseed()
+
+
+def _roll_in_worker(system, context):
+    # Backends are looked up by name rather than pickled, so each worker
+    # rolls with its own generator:
+    from . import BACKENDS
+
+    return BACKENDS[system].evaluate(context)
+
+
+def _odds_in_worker(system, context):
+    from . import BACKENDS
+
+    return BACKENDS[system].odds(context)
+
+
+class RollExecutor:
+    """
+    Runs expensive rolls, and expensive odds, in a process pool, so they
+    can't stall the event loop.
+
+    Each guild gets at most ``guild_concurrency`` rolls in the pool at
+    once and ``guild_queue`` more waiting, so one busy guild can't crowd
+    out the rest. Rolls can be cancelled by the ID of the message that
+    asked for them.
+    """
+
+    def __init__(
+        self,
+        offload_cost=ROLL_OFFLOAD_COST,
+        odds_offload_cost=ODDS_OFFLOAD_COST,
+        workers=ROLL_WORKERS,
+        guild_concurrency=ROLL_GUILD_CONCURRENCY,
+        guild_queue=ROLL_GUILD_QUEUE,
+    ):
+        self.offload_cost = offload_cost
+        self.odds_offload_cost = odds_offload_cost
+        self.workers = workers
+        self.guild_concurrency = guild_concurrency
+        self.guild_queue = guild_queue
+        self._executor = None
+        self._semaphores = {}
+        self._pending = Counter()
+        self._tasks = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_start_worker,
+            )
+        return self._executor
+
+    async def roll(self, backend, context, guild_id=None, message_id=None):
+        if backend.cost(context) < self.offload_cost:
+            return backend.evaluate(context)
+        return await self._offload(
+            _roll_in_worker, backend, context, guild_id, message_id
+        )
+
+    async def odds(self, backend, context, guild_id=None, message_id=None):
+        """
+        Work out the odds of a roll, in the pool if it's a lot of work.
+        """
+        if backend.odds_cost(context) < self.odds_offload_cost:
+            return backend.odds(context)
+        return await self._offload(
+            _odds_in_worker, backend, context, guild_id, message_id
+        )
+
+    async def _offload(self, func, backend, context, guild_id, message_id):
+        if self._pending[guild_id] >= self.guild_concurrency + self.guild_queue:
+            raise RollQueueFullError("Too many big rolls at once, hang on.")
+        self._pending[guild_id] += 1
+        task = asyncio.ensure_future(
+            self._run_in_pool(func, backend.SYSTEM, context, guild_id)
+        )
+        if message_id is not None:
+            self._tasks[message_id] = task
+        try:
+            return await task
+        finally:
+            self._pending[guild_id] -= 1
+            if not self._pending[guild_id]:
+                del self._pending[guild_id]
+                self._semaphores.pop(guild_id, None)
+            self._tasks.pop(message_id, None)
+
+    async def _run_in_pool(self, func, system, context, guild_id):
+        semaphore = self._semaphores.get(guild_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.guild_concurrency)
+            self._semaphores[guild_id] = semaphore
+        async with semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                func,
+                system,
+                context,
+            )
+
+    def cancel(self, message_id):
+        """
+        Give up on the roll for a message. It won't be started if it's
+        still waiting; if it's already running its result is thrown away.
+        """
+        task = self._tasks.get(message_id)
+        if task:
+            task.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+roll_executor = RollExecutor()
@@ -1,29 +1,89 @@
-import re
+import os
 
-from ..base import Base, Roll
-from ..errors import ParseError
+from ..base import Base, RollResult
+from . import odds
+
+# Above this many dice, only report how many of each face came up:
+SUMMARY_THRESHOLD = int(os.environ.get("SUMMARY_THRESHOLD", 100))
+# Discord won't send messages longer than this:
+MESSAGE_LIMIT = 2000
+# List the chance of every total when there are at most this many:
+ODDS_TABLE_SIZE = 20
 
 
 class Generic(Base):
-    DICE = re.compile(r'(\d+)?d(\d+)(?:\s*([+-])\s*(\d+))?')
-
-    def parse(self, dice):
-        groups = self.DICE.match(dice)
-        if not groups:
-            raise ParseError(f"Invalid dice: {dice}")
-        try:
-            number = int(groups.group(1) or 1)
-            sides = int(groups.group(2))
-            polarity = -1 if groups.group(3) == '-' else 1
-            modifier = int(groups.group(4) or 0) * polarity
-        except ValueError:
-            raise ParseError(f"Invalid dice: {dice}")
-        return Roll(number, sides, modifier)
-
-    def render(self, results, context):
-        str_results = ", ".join(str(x) for x in results)
+    SYSTEM = "generic"
+
+    def is_summary(self, context):
+        return context.number > SUMMARY_THRESHOLD
+
+    def evaluate(self, context):
+        if not self.is_summary(context):
+            return super().evaluate(context)
+        counts = self.pool.face_counts(context.number, context.sides)
+        total = sum(
+            face * count
+            for face, count
+            in enumerate(counts, start=1)
+        )
+        return RollResult(
+            self.SYSTEM,
+            context,
+            face_counts=counts,
+            rolled=context.number,
+            total=total + context.modifier,
+        )
+
+    def render(self, result):
+        context = result.context
         show_mod = ""
         if context.modifier:
             show_mod = f" [{context.modifier:+}] "
-        total = sum(results) + context.modifier
-        return f"{str_results}{show_mod} (total {total})"
+        if result.face_counts is not None:
+            return self.render_summary(result, show_mod)
+        str_results = ", ".join(str(x) for x in result.dice)
+        return f"{str_results}{show_mod} (total {result.total})"
+
+    def render_summary(self, result, show_mod):
+        context = result.context
+        histogram = ", ".join(
+            f"{face}×{count}"
+            for face, count
+            in enumerate(result.face_counts, start=1)
+            if count
+        )
+        summary = (
+            f"{context.number}d{context.sides}{show_mod} (total {result.total})"
+        )
+        if len(histogram) + len(summary) + 1 > MESSAGE_LIMIT:
+            return summary
+        return f"{histogram}\n{summary}"
+
+    def odds(self, context):
+        if not odds.within_limits(context.number, context.sides):
+            return "Too many dice to work that out exactly."
+        distribution = odds.sum_distribution(context.number, context.sides)
+        lowest = context.number + context.modifier
+        highest = lowest + len(distribution) - 1
+        mean = context.number * (context.sides + 1) / 2 + context.modifier
+        show_mod = f"{context.modifier:+}" if context.modifier else ""
+        summary = (
+            f"{context.number}d{context.sides}{show_mod}: "
+            f"{lowest} to {highest}, average {mean:.2f}"
+        )
+        if len(distribution) <= ODDS_TABLE_SIZE:
+            lines = [summary]
+            at_least = 1.0
+            for total, p in enumerate(distribution, start=lowest):
+                lines.append(f"{total}: {p:.1%} (or more: {at_least:.1%})")
+                at_least -= p
+            return "\n".join(lines)
+        below = 0.0
+        low = high = None
+        for total, p in enumerate(distribution, start=lowest):
+            below += p
+            if low is None and below >= 0.1:
+                low = total
+            if high is None and below >= 0.9:
+                high = total
+        return f"{summary}\n80% of rolls land between {low} and {high}"
@@ -0,0 +1,116 @@
+import re
+
+from ..base import Roll, WoDRoll
+
+TOKEN = re.compile(r'\s*(\d+|[der+-])')
+SIGNS = ('+', '-')
+
+
+def tokenize(dice):
+    """
+    Split dice into numbers (as ints) and single-character operators.
+    Returns ``None`` if anything else is in there.
+    """
+    tokens = []
+    position = 0
+    dice = dice.rstrip()
+    while position < len(dice):
+        match = TOKEN.match(dice, position)
+        if not match:
+            return None
+        token = match.group(1)
+        tokens.append(int(token) if token.isdigit() else token)
+        position = match.end()
+    return tokens
+
+
+class _Cursor:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self, *accepted):
+        token = self.peek()
+        if token in accepted:
+            self.position += 1
+            return token
+        return None
+
+    def take_number(self):
+        token = self.peek()
+        if isinstance(token, int):
+            self.position += 1
+            return token
+        return None
+
+    def done(self):
+        return self.position == len(self.tokens)
+
+
+def _parse_pbta(cursor):
+    # +/-X
+    polarity = -1 if cursor.take(*SIGNS) == '-' else 1
+    modifier = cursor.take_number()
+    if modifier is None or not cursor.done():
+        return None
+    return "pbta", Roll(2, 6, modifier * polarity)
+
+
+def _parse_generic(cursor):
+    # XdY(+/-Z)
+    number = cursor.take_number()
+    if not cursor.take('d'):
+        return None
+    sides = cursor.take_number()
+    if not sides:
+        return None
+    modifier = 0
+    sign = cursor.take(*SIGNS)
+    if sign:
+        modifier = cursor.take_number()
+        if modifier is None:
+            return None
+        modifier *= -1 if sign == '-' else 1
+    if not cursor.done():
+        return None
+    return "generic", Roll(1 if number is None else number, sides, modifier)
+
+
+def _parse_wod(cursor):
+    # X(eY)(r)
+    number = cursor.take_number()
+    if number is None:
+        return None
+    explode_at = 10
+    if cursor.take('e'):
+        explode_at = cursor.take_number()
+        if explode_at is None or not (7 <= explode_at < 11):
+            return None
+    is_rote = bool(cursor.take('r'))
+    if not cursor.done():
+        return None
+    return "wod", WoDRoll(number, 10, explode_at, is_rote)
+
+
+def parse(dice):
+    """
+    Parse dice in any of the supported systems in one pass.
+
+    Returns a ``(system, context)`` pair, where system is one of
+    ``"generic"``, ``"wod"`` or ``"pbta"``, or ``None`` if the dice
+    aren't valid in any of them.
+    """
+    tokens = tokenize(dice)
+    if not tokens:
+        return None
+    cursor = _Cursor(tokens)
+    if tokens[0] in SIGNS:
+        return _parse_pbta(cursor)
+    if 'd' in tokens:
+        return _parse_generic(cursor)
+    return _parse_wod(cursor)
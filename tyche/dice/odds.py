@@ -0,0 +1,131 @@
+"""
+Exact outcome distributions for each dice system.
+
+Distributions are tuples of probabilities, indexed from the smallest
+possible outcome. The most recently asked-for are memoised by the
+parameters that shape them.
+"""
+import os
+from functools import lru_cache
+
+# Refuse to work out distributions with more possible outcomes (dice
+# times sides) than this; the work grows with dice times outcomes.
+ODDS_MAX_OUTCOMES = int(os.environ.get("ODDS_MAX_OUTCOMES", 10000))
+ODDS_CACHE_SIZE = int(os.environ.get("ODDS_CACHE_SIZE", 64))
+# Drop tail probabilities smaller than this from open-ended distributions:
+EPSILON = 1e-12
+
+
+def convolve(a, b):
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, p in enumerate(a):
+        if p:
+            for j, q in enumerate(b):
+                result[i + j] += p * q
+    return result
+
+
+def _trim(distribution):
+    end = len(distribution)
+    while end > 1 and distribution[end - 1] < EPSILON:
+        end -= 1
+    return tuple(distribution[:end])
+
+
+def within_limits(number, sides):
+    return number * sides <= ODDS_MAX_OUTCOMES
+
+
+def cost(number, sides):
+    """
+    Roughly how many steps working out a distribution takes: each of
+    ``number`` dice adds a pass over up to ``number * sides`` outcomes.
+    """
+    return number * number * sides
+
+
+@lru_cache(maxsize=ODDS_CACHE_SIZE)
+def sum_distribution(number, sides):
+    """
+    Distribution of the total of ``number`` dice with ``sides`` sides,
+    indexed from a total of ``number``.
+    """
+    distribution = [1.0]
+    for _ in range(number):
+        # Adding a die is a convolution with a uniform kernel, so each new
+        # entry is a sliding-window sum over the previous distribution:
+        result = []
+        window = 0.0
+        for total in range(len(distribution) + sides - 1):
+            if total < len(distribution):
+                window += distribution[total]
+            if total >= sides:
+                window -= distribution[total - sides]
+            result.append(window / sides)
+        distribution = result
+    return tuple(distribution)
+
+
+@lru_cache(maxsize=ODDS_CACHE_SIZE)
+def _wod_die(sides, explode_at, is_rote):
+    """
+    Distribution of successes from one WoD die, explosions included.
+    """
+    failure = 6 / sides
+    success = (explode_at - 7) / sides
+    explodes = (sides - explode_at + 1) / sides
+    # An exploding die is a success plus another die that can explode,
+    # so chained successes fall off geometrically:
+    chain = [failure]
+    k = 1
+    while True:
+        p = explodes ** (k - 1) * (success + explodes * failure)
+        if p < EPSILON:
+            break
+        chain.append(p)
+        k += 1
+    if not is_rote:
+        return tuple(chain)
+    # Failed dice are rerolled once, and rerolls don't explode:
+    reroll_success = (sides - 6) / sides
+    die = list(chain)
+    die[0] = failure * failure
+    die[1] += failure * reroll_success
+    return tuple(die)
+
+
+@lru_cache(maxsize=ODDS_CACHE_SIZE)
+def wod_distribution(number, sides, explode_at, is_rote):
+    """
+    Distribution of total successes for a WoD pool, indexed from zero.
+    """
+    die = _wod_die(sides, explode_at, is_rote)
+    distribution = (1.0,)
+    for _ in range(number):
+        distribution = _trim(convolve(distribution, die))
+    return distribution
+
+
+def wod_botch_free_failure(number, sides, is_rote):
+    """
+    Chance of no successes *and* no ones, i.e. a plain failure.
+
+    With no successes nothing exploded, so every die shown is a first
+    roll (or its rote reroll) of 2-6.
+    """
+    plain = 5 / sides
+    if is_rote:
+        plain *= 6 / sides
+    return plain ** number
+
+
+def precompute():
+    """
+    Fill the caches for the pools people roll most, so asking for their
+    odds is instant.
+    """
+    for sides in (4, 6, 8, 10, 12, 20, 100):
+        sum_distribution(10, sides)
+    for explode_at in (8, 9, 10):
+        for is_rote in (False, True):
+            wod_distribution(20, 10, explode_at, is_rote)
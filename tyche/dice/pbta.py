@@ -1,31 +1,36 @@
-import re
+from ..base import Base
+from . import odds
 
-from ..base import Base, Roll
-from ..errors import ParseError
+
+def outcome(result):
+    if result < 7:
+        return "Miss"
+    if 7 <= result < 10:
+        return "Weak hit"
+    if 10 <= result < 12:
+        return "Strong hit"
+    return "Exceptional hit"
 
 
 class PbtA(Base):
-    DICE = re.compile(r'([+-])(\d+)')
+    SYSTEM = "pbta"
+
+    def evaluate(self, context):
+        result = super().evaluate(context)
+        result.tier = outcome(result.total)
+        return result
 
-    def parse(self, dice):
-        groups = self.DICE.match(dice)
-        if not groups:
-            raise ParseError(f"Invalid dice: {dice}")
-        try:
-            number = 2
-            polarity = -1 if groups.group(1) == '-' else 1
-            modifier = int(groups.group(2)) * polarity
-            sides = 6
-        except ValueError:
-            raise ParseError(f"Invalid dice: {dice}")
-        return Roll(number, sides, modifier)
+    def render(self, result):
+        return f"{result.tier} [{result.total}]"
 
-    def render(self, result, context):
-        result = sum(result) + context.modifier
-        if result < 7:
-            return f"Miss [{result}]"
-        if 7 <= result < 10:
-            return f"Weak hit [{result}]"
-        if 10 <= result < 12:
-            return f"Strong hit [{result}]"
-        return f"Exceptional hit [{result}]"
+    def odds(self, context):
+        distribution = odds.sum_distribution(context.number, context.sides)
+        bands = {}
+        for total, p in enumerate(distribution, start=context.number):
+            band = outcome(total + context.modifier)
+            bands[band] = bands.get(band, 0) + p
+        return "\n".join(
+            f"{band}: {p:.1%}"
+            for band, p
+            in bands.items()
+        )
@@ -1,82 +1,132 @@
-import re
-from random import randint
+import os
 from collections import namedtuple
 
-from ..base import Base
-from ..errors import ParseError
+from ..base import Base, RollResult
+from ..pool import MAX_DICE
+from . import odds
+from .generic import SUMMARY_THRESHOLD
 
+# Most dice, explosions included, that one roll may throw:
+WOD_MAX_DICE = int(os.environ.get("WOD_MAX_DICE", 2 * MAX_DICE))
 
-Roll = namedtuple('Roll', ('number', 'sides', 'explode_at', 'is_rote'))
+# ``dice`` is only kept for pools small enough to show, otherwise None.
+Tally = namedtuple(
+    'Tally',
+    ('dice', 'rolled', 'successes', 'botches', 'capped'),
+)
+
+
+def explode(pool, context, max_dice=WOD_MAX_DICE, keep_dice=True):
+    """
+    Roll a WoD pool, tallying successes and botches round by round.
+
+    Each round draws as many dice as the last round exploded. Stops once
+    ``max_dice`` have been thrown, with ``capped`` set if dice were still
+    due to explode.
+    """
+    sides = context.sides
+    first = pool.draw(context.number, sides)
+    # Get explodables before rote, but actually explode after rote,
+    # as rerolled dice from a rote aren't eligible for explosion:
+    explodables = pool.count_at_least(first, context.explode_at)
+    successes = pool.count_at_least(first, 7)
+    rolled = context.number
+
+    if context.is_rote:
+        rerolls = pool.draw(context.number - successes, sides)
+        rolled += len(rerolls)
+        successes += pool.count_at_least(rerolls, 7)
+        botches = pool.count_equal(rerolls, 1)
+        kept = [pool.at_least(first, 7), rerolls]
+    else:
+        botches = pool.count_equal(first, 1)
+        kept = [first]
+
+    while explodables and rolled < max_dice:
+        new_dice = pool.draw(min(explodables, max_dice - rolled), sides)
+        rolled += len(new_dice)
+        successes += pool.count_at_least(new_dice, 7)
+        botches += pool.count_equal(new_dice, 1)
+        explodables = pool.count_at_least(new_dice, context.explode_at)
+        if keep_dice:
+            kept.append(new_dice)
+
+    dice = pool.concat(*kept) if keep_dice else None
+    return Tally(dice, rolled, successes, botches, bool(explodables))
+
+
+def outcome(successes, botches):
+    if botches and not successes:
+        return "Dramatic failure"
+    if not successes:
+        return "Failure"
+    if successes < 5:
+        return "Success"
+    return "Exceptional success"
 
 
 class WoD(Base):
-    DICE = re.compile(r'(\d+)(?:e(\d+))?(r?)')
-
-    def parse(self, dice):
-        groups = self.DICE.match(dice)
-        if not groups:
-            raise ParseError(f"Invalid dice: {dice}")
-        try:
-            number = int(groups.group(1))
-            sides = 10
-            explode_at = int(groups.group(2) or 10)
-            if not (7 <= explode_at < 11):
-                raise ParseError(f"Invalid explode: {explode_at}")
-            is_rote = bool(groups.group(3) or False)
-        except ValueError:
-            raise ParseError(f"Invalid dice: {dice}")
-        return Roll(number, sides, explode_at, is_rote)
-
-    def render(self, result, context):
-        sorted_results = ", ".join(map(str, reversed(sorted(result))))
-        successes = len([die for die in result if die >= 7])
-        botches = len([die for die in result if die == 1])
-        if botches and not successes:
-            result_type = "Dramatic failure"
-        elif not successes:
-            result_type = "Failure"
-        elif successes < 5:
-            result_type = f"Success [{successes}]"
+    SYSTEM = "wod"
+
+    def render(self, result):
+        successes = result.successes
+        result_type = result.tier
+        if successes:
+            result_type += f" [{successes}]"
+        if result.dice is not None and result.rolled <= SUMMARY_THRESHOLD:
+            shown = ", ".join(map(str, sorted(result.dice, reverse=True)))
         else:
-            result_type = f"Exceptional success [{successes}]"
-        return f"{result_type}\n({sorted_results})"
-
-    def do_roll(self, context):
-        results = [randint(1, context.sides) for _ in range(context.number)]
-        # Get explodables before rote, but actually explode after rote,
-        # as rerolled dice from a rote aren't eligible for explosion:
-        explodables = [
-            die
-            for die
-            in results
-            if die >= context.explode_at
-        ]
+            shown = f"{result.rolled} dice"
+        if result.capped:
+            shown += ", stopped exploding at the limit"
+        return f"{result_type}\n({shown})"
 
-        if context.is_rote:
-            successes = [
-                die
-                for die
-                in results
-                if die >= 7
-            ]
-            rerolls = [
-                randint(1, context.sides)
-                for _
-                in range(len(results) - len(successes))
-            ]
-            results = successes + rerolls
-
-        while any(explodables):
-            new_dice = [
-                randint(1, context.sides)
-                for _
-                in range(len(explodables))
-            ]
-            explodables = [
-                die
-                for die
-                in new_dice
-                if die >= context.explode_at
-            ]
-            results += new_dice
-        return results
+    def cost(self, context):
+        # With 7-again, explosions add two thirds of the pool again on
+        # average:
+        return context.number * 5 // 3
+
+    def evaluate(self, context):
+        tally = explode(
+            self.pool,
+            context,
+            keep_dice=context.number <= SUMMARY_THRESHOLD,
+        )
+        return RollResult(
+            self.SYSTEM,
+            context,
+            dice=tally.dice,
+            rolled=tally.rolled,
+            successes=tally.successes,
+            botches=tally.botches,
+            tier=outcome(tally.successes, tally.botches),
+            capped=tally.capped,
+        )
+
+    def odds(self, context):
+        if not odds.within_limits(context.number, context.sides):
+            return "Too many dice to work that out exactly."
+        distribution = odds.wod_distribution(*context)
+        failure = odds.wod_botch_free_failure(
+            context.number,
+            context.sides,
+            context.is_rote,
+        )
+        bands = {
+            "Dramatic failure": distribution[0] - failure,
+            "Failure": failure,
+            "Success": sum(distribution[1:5]),
+            "Exceptional success": sum(distribution[5:]),
+        }
+        mean = sum(
+            successes * p
+            for successes, p
+            in enumerate(distribution)
+        )
+        lines = [
+            f"{band}: {p:.1%}"
+            for band, p
+            in bands.items()
+        ]
+        lines.append(f"Average successes: {mean:.2f}")
+        return "\n".join(lines)
@@ -1,2 +1,14 @@
 class ParseError(Exception):
     pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class PoolTooLargeError(ParseError):
+    pass
+
+
+class RollQueueFullError(Exception):
+    pass
@@ -0,0 +1,105 @@
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+
+
+# Column types that differ between the backends we support:
+DIALECT_TYPES = {
+    "sqlite": {
+        "pk": "INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL",
+        "timestamp": "TIMESTAMP",
+    },
+    "postgres": {
+        "pk": "SERIAL NOT NULL PRIMARY KEY",
+        "timestamp": "TIMESTAMPTZ",
+    },
+}
+
+
+async def _create_roll_history(connection):
+    types = DIALECT_TYPES[connection.capabilities.dialect]
+    await connection.execute_script(
+        "CREATE TABLE IF NOT EXISTS rollrecord ("
+        f"id {types['pk']}, "
+        "guild_id BIGINT, "
+        "user_id BIGINT NOT NULL, "
+        f"created_at {types['timestamp']} NOT NULL, "
+        "system VARCHAR(16) NOT NULL, "
+        "dice VARCHAR(64) NOT NULL, "
+        "pool INT NOT NULL, "
+        "total BIGINT, "
+        "successes INT, "
+        "succeeded SMALLINT, "
+        "tier VARCHAR(32))"
+    )
+    await connection.execute_script(
+        "CREATE INDEX IF NOT EXISTS rollrecord_guild_id_user_id_created_at "
+        "ON rollrecord (guild_id, user_id, created_at)"
+    )
+
+
+# Each migration is a list of steps, applied in order. A step is either
+# SQL to execute or a coroutine function taking the connection. The
+# models always describe the latest schema, so a brand new database is
+# generated from them directly and stamped with the latest version.
+MIGRATIONS = [
+    # 1: Indices for EmojiMessage lookups, for databases created before
+    # they were declared on the model.
+    [
+        "CREATE UNIQUE INDEX IF NOT EXISTS emojimessage_message_id_emoji "
+        "ON emojimessage (message_id, emoji)",
+        "CREATE INDEX IF NOT EXISTS emojimessage_message_id "
+        "ON emojimessage (message_id)",
+    ],
+    # 2: Roll history.
+    [
+        _create_roll_history,
+    ],
+]
+
+LATEST = len(MIGRATIONS)
+
+
+async def _has_tables(connection):
+    try:
+        await connection.execute_query("SELECT 1 FROM emojimessage LIMIT 1")
+    except OperationalError:
+        return False
+    return True
+
+
+async def _get_version(connection):
+    await connection.execute_script(
+        "CREATE TABLE IF NOT EXISTS tyche_schema (version INTEGER NOT NULL)"
+    )
+    rows = await connection.execute_query_dict("SELECT version FROM tyche_schema")
+    if rows:
+        return rows[0]["version"]
+    # Databases from before migrations existed already have tables:
+    version = 0 if await _has_tables(connection) else None
+    await connection.execute_query(
+        "INSERT INTO tyche_schema (version) VALUES (0)"
+    )
+    return version
+
+
+async def _set_version(connection, version):
+    await connection.execute_query(
+        f"UPDATE tyche_schema SET version = {int(version)}"
+    )
+
+
+async def migrate(connection):
+    version = await _get_version(connection)
+    if version is None:
+        print("Creating database schema")
+        await Tortoise.generate_schemas()
+        await _set_version(connection, LATEST)
+        return
+    for number, steps in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Applying database migration {number}")
+        for step in steps:
+            if isinstance(step, str):
+                await connection.execute_script(step)
+            else:
+                await step(connection)
+        await _set_version(connection, number)
@@ -1,18 +1,262 @@
+import os
+import asyncio
+from datetime import datetime, timezone
+
 from tortoise import fields, Tortoise
+from tortoise.functions import Count, Sum
 from tortoise.models import Model
+from tortoise.transactions import in_transaction
+
+from .migrations import migrate
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite://db.sqlite3")
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 10))
+# WAL lets readers carry on while we write; NORMAL is durable enough in
+# WAL mode and saves an fsync per transaction.
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+# Roll history is written in bulk once this many seconds have passed or
+# this many rolls are waiting, whichever comes first:
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", 2))
+HISTORY_FLUSH_ROWS = int(os.environ.get("HISTORY_FLUSH_ROWS", 500))
+# ;stats shows at most this many WoD pool sizes:
+WOD_STATS_ROWS = int(os.environ.get("WOD_STATS_ROWS", 20))
+
+_initialized = False
+
+
+def _db_url(url=DATABASE_URL, pool_size=DATABASE_POOL_SIZE):
+    if url.startswith(("postgres://", "asyncpg://")) and "maxsize=" not in url:
+        separator = "&" if "?" in url else "?"
+        url = f"{url}{separator}minsize=1&maxsize={pool_size}"
+    return url
 
 
 async def init():
+    # on_ready fires again on every reconnect, but we only need to set up
+    # the database once per process:
+    global _initialized
+    if _initialized:
+        return
     await Tortoise.init(
-        db_url='sqlite://db.sqlite3',
+        db_url=_db_url(),
         modules={'models': ['tyche.models']}
     )
-    # Generate the schema
-    await Tortoise.generate_schemas()
+    connection = Tortoise.get_connection("default")
+    if DATABASE_URL.startswith("sqlite"):
+        await connection.execute_script(
+            f"PRAGMA journal_mode=WAL; PRAGMA synchronous={SQLITE_SYNCHRONOUS};"
+        )
+    await migrate(connection)
+    _initialized = True
+
+
+async def close():
+    global _initialized
+    await Tortoise.close_connections()
+    _initialized = False
 
 
 class EmojiMessage(Model):
     id = fields.IntField(pk=True)
-    message_id = fields.IntField()
-    emoji = fields.TextField()
+    message_id = fields.BigIntField(index=True)
+    emoji = fields.CharField(max_length=64)
     role = fields.TextField()
+
+    class Meta:
+        unique_together = (("message_id", "emoji"),)
+
+
+async def save_emoji_map(message_id, emoji_map, previous=None):
+    """
+    Persist the emoji map for one message, writing only the
+    (message_id, emoji) pairs that differ from ``previous``, in one
+    transaction.
+    """
+    previous = previous or {}
+    changed = {
+        emoji: role
+        for emoji, role
+        in emoji_map.items()
+        if previous.get(emoji) != role
+    }
+    # Changed pairs are deleted and re-inserted, which gives us an upsert
+    # that works on every backend:
+    outdated = [
+        emoji
+        for emoji
+        in previous
+        if emoji not in emoji_map or emoji in changed
+    ]
+    if not (changed or outdated):
+        return
+    async with in_transaction() as connection:
+        if outdated:
+            await EmojiMessage.filter(
+                message_id=message_id,
+                emoji__in=outdated,
+            ).using_db(connection).delete()
+        if changed:
+            await EmojiMessage.bulk_create(
+                [
+                    EmojiMessage(message_id=message_id, emoji=emoji, role=role)
+                    for emoji, role
+                    in changed.items()
+                ],
+                using_db=connection,
+            )
+
+
+class RollRecord(Model):
+    id = fields.IntField(pk=True)
+    guild_id = fields.BigIntField(null=True)
+    user_id = fields.BigIntField()
+    created_at = fields.DatetimeField()
+    system = fields.CharField(max_length=16)
+    dice = fields.CharField(max_length=64)
+    # How many dice were asked for, e.g. the WoD pool size:
+    pool = fields.IntField()
+    total = fields.BigIntField(null=True)
+    successes = fields.IntField(null=True)
+    # 1 or 0, so that averaging it gives a success rate:
+    succeeded = fields.SmallIntField(null=True)
+    tier = fields.CharField(max_length=32, null=True)
+
+    class Meta:
+        indexes = (("guild_id", "user_id", "created_at"),)
+
+
+class RollHistory:
+    """
+    Buffers roll records in memory and writes them with one bulk insert,
+    so recording a roll never waits on the database.
+    """
+
+    def __init__(
+        self,
+        flush_interval=HISTORY_FLUSH_INTERVAL,
+        flush_rows=HISTORY_FLUSH_ROWS,
+    ):
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self._buffer = []
+        self._timer = None
+
+    def record(self, guild_id, user_id, dice, result):
+        successes = result.successes
+        self._buffer.append(RollRecord(
+            guild_id=guild_id,
+            user_id=user_id,
+            created_at=datetime.now(timezone.utc),
+            system=result.system,
+            dice=dice[:64],
+            pool=result.context.number,
+            total=result.total,
+            successes=successes,
+            succeeded=None if successes is None else int(successes > 0),
+            tier=result.tier,
+        ))
+        if len(self._buffer) >= self.flush_rows:
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(
+                self.flush_interval,
+                lambda: asyncio.ensure_future(self.flush()),
+            )
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        try:
+            await RollRecord.bulk_create(rows)
+        except Exception as e:
+            print(f"Dropped {len(rows)} roll history records: {e!r}")
+
+    async def recent(self, guild_id, user_id, limit=10):
+        await self.flush()
+        return await RollRecord.filter(
+            guild_id=guild_id,
+            user_id=user_id,
+        ).order_by("-created_at").limit(limit)
+
+    async def stats(self, guild_id, user_id):
+        """
+        Per system: how many rolls, and their average total.
+        """
+        await self.flush()
+        # Tortoise casts Avg back to the field's type, which would
+        # truncate it to an integer, so we divide sums ourselves:
+        rows = await RollRecord.filter(
+            guild_id=guild_id,
+            user_id=user_id,
+        ).annotate(
+            rolls=Count("id"),
+            total_sum=Sum("total"),
+            total_count=Count("total"),
+        ).group_by("system").values(
+            "system",
+            "rolls",
+            "total_sum",
+            "total_count",
+        )
+        return [
+            {
+                "system": row["system"],
+                "rolls": row["rolls"],
+                "average": _average(row["total_sum"], row["total_count"]),
+            }
+            for row
+            in rows
+        ]
+
+    async def wod_stats(self, guild_id, user_id, limit=WOD_STATS_ROWS):
+        """
+        Per WoD pool size: how many rolls, average successes and how
+        often the roll succeeded. Only the ``limit`` most rolled pool
+        sizes are included, in order of size.
+        """
+        await self.flush()
+        rows = await RollRecord.filter(
+            guild_id=guild_id,
+            user_id=user_id,
+            system="wod",
+        ).annotate(
+            rolls=Count("id"),
+            successes_sum=Sum("successes"),
+            successes_count=Count("successes"),
+            succeeded_sum=Sum("succeeded"),
+            succeeded_count=Count("succeeded"),
+        ).group_by("pool").order_by("-rolls", "pool").limit(limit).values(
+            "pool",
+            "rolls",
+            "successes_sum",
+            "successes_count",
+            "succeeded_sum",
+            "succeeded_count",
+        )
+        rows = sorted(rows, key=lambda row: row["pool"])
+        return [
+            {
+                "pool": row["pool"],
+                "rolls": row["rolls"],
+                "average": _average(row["successes_sum"], row["successes_count"]),
+                "success_rate": _average(
+                    row["succeeded_sum"],
+                    row["succeeded_count"],
+                ),
+            }
+            for row
+            in rows
+        ]
+
+
+def _average(total, count):
+    if not count:
+        return None
+    return total / count
+
+
+roll_history = RollHistory()
@@ -0,0 +1,115 @@
+import os
+import random
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAX_DICE = int(os.environ.get("MAX_DICE", 10 ** 6))
+MAX_SIDES = int(os.environ.get("MAX_SIDES", 10 ** 6))
+DICE_SEED = os.environ.get("DICE_SEED")
+# Draw this many dice at a time when counting faces without NumPy:
+CHUNK_SIZE = 65536
+
+
+class DicePool:
+    """
+    Draws whole dice pools at once from one seeded generator, and counts
+    and totals them in bulk.
+
+    Uses NumPy arrays when NumPy is installed, and falls back to plain
+    ``array``s and the ``random`` module when it isn't. Callers should
+    only touch pools through these methods, so they work either way.
+    """
+
+    def __init__(self, seed=None, use_numpy=numpy is not None):
+        self.use_numpy = use_numpy
+        self.reseed(seed)
+
+    def reseed(self, seed=None):
+        if self.use_numpy:
+            self.rng = numpy.random.default_rng(seed)
+        else:
+            self.rng = random.Random(seed)
+
+    def draw(self, number, sides):
+        if self.use_numpy:
+            return self.rng.integers(1, sides + 1, size=number)
+        return array("l", self.rng.choices(range(1, sides + 1), k=number))
+
+    def concat(self, *pools):
+        if self.use_numpy:
+            return numpy.concatenate(pools)
+        result = array("l")
+        for pool in pools:
+            result.extend(pool)
+        return result
+
+    def total(self, dice):
+        if self.use_numpy:
+            return int(dice.sum())
+        return sum(dice)
+
+    def count_at_least(self, dice, threshold):
+        if self.use_numpy:
+            return int(numpy.count_nonzero(dice >= threshold))
+        return sum(1 for die in dice if die >= threshold)
+
+    def count_equal(self, dice, value):
+        if self.use_numpy:
+            return int(numpy.count_nonzero(dice == value))
+        return dice.count(value)
+
+    def at_least(self, dice, threshold):
+        if self.use_numpy:
+            return dice[dice >= threshold]
+        return array("l", (die for die in dice if die >= threshold))
+
+    def counts(self, dice, sides):
+        """
+        How many of each face came up, as a list indexed from face 1.
+        """
+        if self.use_numpy:
+            return numpy.bincount(dice, minlength=sides + 1)[1:].tolist()
+        counter = Counter(dice)
+        return [counter[face] for face in range(1, sides + 1)]
+
+    def face_counts(self, number, sides):
+        """
+        Roll ``number`` dice but only keep how many of each face came up,
+        as a list indexed from face 1.
+
+        This is a multinomial draw over the faces, so it takes O(sides)
+        time and memory however many dice there are. Without NumPy (or
+        ``random.binomialvariate``, Python 3.12+) it rolls in chunks
+        instead, which is O(number) time but still O(sides) memory.
+        """
+        if self.use_numpy:
+            return self.rng.multinomial(number, [1 / sides] * sides).tolist()
+        if hasattr(self.rng, "binomialvariate"):
+            counts = []
+            remaining = number
+            for face in range(1, sides):
+                # Of the dice not yet assigned a face, each is equally
+                # likely to be any of the faces left:
+                count = self.rng.binomialvariate(remaining, 1 / (sides - face + 1))
+                counts.append(count)
+                remaining -= count
+            counts.append(remaining)
+            return counts
+        counts = [0] * sides
+        for start in range(0, number, CHUNK_SIZE):
+            chunk = self.draw(min(CHUNK_SIZE, number - start), sides)
+            for face, count in Counter(chunk).items():
+                counts[face - 1] += count
+        return counts
+
+
+default_pool = DicePool(seed=int(DICE_SEED) if DICE_SEED else None)
+
+
+def within_limits(context):
+    return context.number <= MAX_DICE and context.sides <= MAX_SIDES
@@ -0,0 +1,136 @@
+import os
+import time
+from collections import OrderedDict
+
+from discord.ext.commands import CheckFailure
+
+# Tokens refill at RATE per second, up to BURST, for each user's use of
+# each command...
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 0.5))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 5))
+# ...and for everything in a guild together:
+GUILD_RATE_LIMIT_RATE = float(os.environ.get("GUILD_RATE_LIMIT_RATE", 5))
+GUILD_RATE_LIMIT_BURST = float(os.environ.get("GUILD_RATE_LIMIT_BURST", 30))
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", 10000))
+RATE_LIMIT_IDLE = float(os.environ.get("RATE_LIMIT_IDLE", 600))
+
+# Commands that cost us more (ytdl extraction, bulk deletes) use up more
+# tokens; everything else costs 1. A user's bucket for a costly command
+# holds at least one use of it.
+COMMAND_COSTS = {
+    "play": 5,
+    "clear": 10,
+    "rules": 10,
+}
+
+
+class RateLimited(CheckFailure):
+    pass
+
+
+class TokenBuckets:
+    """
+    Token buckets keyed by anything hashable.
+
+    Buckets are kept in least-recently-used order; ones idle for longer
+    than ``idle_timeout`` (by which point they'd be full anyway) are
+    dropped, as are the least recently used beyond ``max_buckets``.
+    """
+
+    def __init__(
+        self,
+        rate,
+        burst,
+        max_buckets=RATE_LIMIT_MAX_BUCKETS,
+        idle_timeout=RATE_LIMIT_IDLE,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self.idle_timeout = idle_timeout
+        # {
+        #   [key]: [tokens, last updated]
+        # }
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _evict(self, now):
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            idle = now - updated > self.idle_timeout
+            if not idle and len(self._buckets) <= self.max_buckets:
+                break
+            del self._buckets[key]
+
+    def available(self, key, now, burst=None):
+        burst = burst or self.burst
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return burst
+        tokens, updated = bucket
+        return min(burst, tokens + (now - updated) * self.rate)
+
+    def take(self, key, cost, now, burst=None):
+        self._buckets[key] = [self.available(key, now, burst) - cost, now]
+        self._buckets.move_to_end(key)
+        self._evict(now)
+
+
+class RateLimiter:
+    """
+    Only lets a command through if both the user's bucket for that
+    command and the guild's bucket have enough tokens for it.
+    """
+
+    def __init__(self, costs=COMMAND_COSTS):
+        self.costs = costs
+        self.users = TokenBuckets(RATE_LIMIT_RATE, RATE_LIMIT_BURST)
+        self.guilds = TokenBuckets(GUILD_RATE_LIMIT_RATE, GUILD_RATE_LIMIT_BURST)
+        self.limited = 0
+        for name, cost in costs.items():
+            if cost > self.guilds.burst:
+                raise ValueError(
+                    f"{name} costs {cost} tokens, but a guild only holds "
+                    f"{self.guilds.burst}, so it could never run"
+                )
+
+    def acquire(self, guild_id, user_id, command_name):
+        now = time.monotonic()
+        cost = self.costs.get(command_name, 1)
+        user_key = guild_id, user_id, command_name
+        user_burst = max(self.users.burst, cost)
+        if (
+            self.users.available(user_key, now, user_burst) < cost
+            or self.guilds.available(guild_id, now) < cost
+        ):
+            self.limited += 1
+            return False
+        self.users.take(user_key, cost, now, user_burst)
+        self.guilds.take(guild_id, cost, now)
+        return True
+
+
+rate_limiter = RateLimiter()
+
+
+def _is_invoked(ctx):
+    # Checks also run when help works out which commands to list, with
+    # ctx.command set to each of them in turn; only the command that was
+    # actually called should be charged for.
+    command = ctx.command
+    return ctx.invoked_with in (command.name, *command.aliases)
+
+
+async def check_rate_limit(ctx):
+    if not _is_invoked(ctx):
+        return True
+    allowed = rate_limiter.acquire(
+        getattr(ctx.guild, "id", None),
+        ctx.author.id,
+        ctx.command.qualified_name,
+    )
+    if not allowed:
+        raise RateLimited(f"{ctx.author} is calling {ctx.command} too often")
+    return True
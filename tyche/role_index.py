@@ -0,0 +1,58 @@
+class RoleIndex:
+    """
+    Per-guild lookup of role name to role ID, so commands don't have to
+    scan ``guild.roles``.
+
+    Each guild's index is built on first use and dropped whenever one of
+    its roles changes, to be rebuilt on next use. The intersection with a
+    guild's acceptable role names is memoised the same way.
+    """
+
+    def __init__(self):
+        # {
+        #   [guild.id]: {
+        #     [role.name]: role.id
+        #   }
+        # }
+        self._by_name = {}
+        # {
+        #   [guild.id]: (acceptable_names, [sorted role names])
+        # }
+        self._acceptable = {}
+
+    def _names(self, guild):
+        names = self._by_name.get(guild.id)
+        if names is None:
+            names = {}
+            for role in guild.roles:
+                # Keep the first of any duplicate names, as a scan would.
+                names.setdefault(role.name, role.id)
+            self._by_name[guild.id] = names
+        return names
+
+    def get(self, guild, name):
+        role_id = self._names(guild).get(name)
+        return role_id and guild.get_role(role_id)
+
+    def acceptable_names(self, guild, acceptable):
+        """
+        The sorted names of roles in ``guild`` that are in ``acceptable``.
+        """
+        cached = self._acceptable.get(guild.id)
+        if cached is None or cached[0] != acceptable:
+            names = sorted(set(self._names(guild)) & acceptable)
+            cached = acceptable, names
+            self._acceptable[guild.id] = cached
+        return cached[1]
+
+    def get_acceptable(self, guild, name, acceptable):
+        if name not in acceptable:
+            return None
+        return self.get(guild, name)
+
+    def invalidate(self, guild):
+        self._by_name.pop(guild.id, None)
+        self._acceptable.pop(guild.id, None)
+
+
+ROLE_INDEX = RoleIndex()
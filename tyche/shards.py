@@ -0,0 +1,56 @@
+import time
+from collections import Counter
+
+import discord
+
+
+def _shard_for(args, shard_count):
+    """
+    Work out which shard an event came in on from its arguments, or
+    ``None`` if it isn't tied to a guild.
+    """
+    for arg in args:
+        guild = arg if isinstance(arg, discord.Guild) else getattr(arg, "guild", None)
+        if guild is not None:
+            return guild.shard_id or 0
+        guild_id = getattr(arg, "guild_id", None)
+        if guild_id:
+            return (guild_id >> 22) % (shard_count or 1)
+    return None
+
+
+class ShardStats:
+    """
+    Counts dispatched events per shard, and logs latency, guild count and
+    event rate for each shard on request.
+    """
+
+    def __init__(self):
+        self.events = Counter()
+        self.since = time.monotonic()
+
+    def record(self, client, args):
+        self.events[_shard_for(args, client.shard_count)] += 1
+
+    def _latencies(self, client):
+        if isinstance(client, discord.AutoShardedClient):
+            return dict(client.latencies)
+        return {client.shard_id or 0: client.latency}
+
+    def report(self, client):
+        now = time.monotonic()
+        elapsed = max(now - self.since, 1e-9)
+        guilds = Counter(guild.shard_id or 0 for guild in client.guilds)
+        for shard_id, latency in sorted(self._latencies(client).items()):
+            rate = self.events[shard_id] / elapsed
+            print(
+                f"Shard {shard_id}: {latency * 1000:.0f}ms latency | "
+                f"{guilds[shard_id]} guilds | {rate:.1f} events/s"
+            )
+        unsharded = self.events[None] / elapsed
+        print(f"Events not tied to a guild: {unsharded:.1f} events/s")
+        self.events.clear()
+        self.since = now
+
+
+shard_stats = ShardStats()
@@ -0,0 +1,68 @@
+"""
+A local stand-in for the settings API, for tests and development.
+
+Serves the ``prefix``, ``roles`` and ``streaming_role`` endpoints (and
+their ``bulk`` variants) from an in-memory dict. Run it with
+``python -m tyche.stub_api`` and point ``API_ROOT`` at
+``http://localhost:8000/api/``.
+"""
+import os
+import json
+
+from aiohttp import web
+
+DEFAULTS = {
+    "prefix": {"prefix": ";"},
+    "roles": {"roles": []},
+    "streaming_role": {"streaming_role": None, "streaming_role_requires": None},
+}
+
+
+def make_app(settings=None, defaults=DEFAULTS, bulk=True):
+    """
+    Build the stub app. ``settings`` maps server ID to a dict of
+    endpoint payloads; guilds or endpoints missing from it get
+    ``defaults``. With ``bulk`` off the bulk endpoints 404, as on an API
+    that doesn't have them.
+    """
+    settings = settings if settings is not None else {}
+
+    def lookup(endpoint, server_id):
+        guild_settings = settings.get(int(server_id), {})
+        return guild_settings.get(endpoint, defaults[endpoint])
+
+    async def single(request):
+        endpoint = request.match_info["endpoint"]
+        if endpoint not in defaults:
+            raise web.HTTPNotFound()
+        return web.json_response(lookup(endpoint, request.query["server_id"]))
+
+    async def bulk_lookup(request):
+        endpoint = request.match_info["endpoint"]
+        if endpoint not in defaults:
+            raise web.HTTPNotFound()
+        return web.json_response({
+            server_id: lookup(endpoint, server_id)
+            for server_id
+            in request.query.getall("server_id", [])
+        })
+
+    app = web.Application()
+    app["settings"] = settings
+    app.router.add_get("/api/{endpoint}/", single)
+    if bulk:
+        app.router.add_get("/api/{endpoint}/bulk/", bulk_lookup)
+    return app
+
+
+if __name__ == "__main__":
+    settings_file = os.environ.get("STUB_API_SETTINGS")
+    settings = {}
+    if settings_file:
+        with open(settings_file) as f:
+            settings = {
+                int(server_id): guild_settings
+                for server_id, guild_settings
+                in json.load(f).items()
+            }
+    web.run_app(make_app(settings), port=int(os.environ.get("PORT", 8000)))
@@ -1,7 +1,29 @@
+import os
+import re
+import time
 import datetime
 import discord
 import functools
 import youtube_dl
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+
+from .audio_cache import CachedOpusSource, audio_cache
+from .cache import TTLCache
+
+# Extraction results are reused until STREAM_URL_MARGIN seconds before
+# their stream URL expires, or for EXTRACT_CACHE_TTL seconds if it
+# doesn't say when that is.
+EXTRACT_CACHE_TTL = float(os.environ.get("EXTRACT_CACHE_TTL", 1800))
+STREAM_URL_MARGIN = float(os.environ.get("STREAM_URL_MARGIN", 60))
+EXTRACT_CACHE_SIZE = int(os.environ.get("EXTRACT_CACHE_SIZE", 256))
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 4))
+# Playlists are listed this many entries at a time:
+PLAYLIST_PAGE_SIZE = int(os.environ.get("PLAYLIST_PAGE_SIZE", 25))
+
+DEFAULT_FORMAT = "webm[abr>0]/bestaudio/best"
+# Query parameters that don't change what gets played:
+IGNORED_PARAMS = {"feature", "si", "ab_channel"}
 
 
 async def create_ytdl_source(voice, url, *, ytdl_options=None, **kwargs):
@@ -75,25 +97,231 @@ async def create_ytdl_source(voice, url, *, ytdl_options=None, **kwargs):
         See :meth:`create_stream_player` for base operations.
     """
     use_avconv = kwargs.get("use_avconv", False)
-    opts = {"format": "webm[abr>0]/bestaudio/best", "prefer_ffmpeg": not use_avconv}
+    ydl, info = await extract_info(
+        voice.loop,
+        url,
+        ytdl_options=ytdl_options,
+        use_avconv=use_avconv,
+    )
+    return create_source(ydl, url, info)
+
+
+def normalize_url(url):
+    """
+    Reduce ``url`` to a canonical form, so that links to the same track
+    share a cache entry.
+    """
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+    query = parse_qs(parsed.query)
+    path = parsed.path
+    if host == "youtu.be":
+        host, path = "youtube.com", "/watch"
+        query["v"] = [parsed.path.lstrip("/")]
+    query = sorted(
+        (key, value)
+        for key, values
+        in query.items()
+        if key not in IGNORED_PARAMS and not key.startswith("utm_")
+        for value
+        in values
+    )
+    return urlunparse(
+        ("https", host, path.rstrip("/"), "", urlencode(query), "")
+    )
+
+
+class Extractor:
+    """
+    Runs ``youtube_dl`` extraction in its own bounded thread pool, so
+    slow lookups can't starve other executor work, and caches the results.
+
+    Results are cached by normalized URL and options, and reused until
+    their signed stream URL is about to expire. There's one ``YoutubeDL``
+    per set of options, shared between lookups.
+    """
+
+    def __init__(self, workers=EXTRACT_WORKERS):
+        self.workers = workers
+        # A failed lookup mustn't fall back to an old, possibly dead,
+        # stream URL.
+        self.cache = TTLCache(
+            EXTRACT_CACHE_TTL,
+            maxsize=EXTRACT_CACHE_SIZE,
+            serve_last_good=False,
+            ttl_for=self._ttl_for,
+        )
+        # {
+        #   [options key]: YoutubeDL
+        # }
+        self._ydls = {}
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="ytdl"
+            )
+        return self._executor
+
+    @staticmethod
+    def _ttl_for(info):
+        expiry = stream_url_expiry(info)
+        if expiry is None:
+            return None
+        return max(expiry - time.time() - STREAM_URL_MARGIN, 0)
+
+    def _ydl(self, opts):
+        key = repr(sorted(opts.items()))
+        ydl = self._ydls.get(key)
+        if ydl is None:
+            ydl = self._ydls[key] = youtube_dl.YoutubeDL(opts)
+        return key, ydl
+
+    async def extract(self, loop, url, opts, min_validity=0):
+        """
+        The ``YoutubeDL`` and info dict for ``url``, from the cache if its
+        stream URL is good for at least ``min_validity`` more seconds
+        (and entries are dropped ``STREAM_URL_MARGIN`` seconds before it
+        expires regardless).
+        """
+        key, ydl = self._ydl(opts)
+        cache_key = normalize_url(url), key
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            expiry = stream_url_expiry(cached)
+            if expiry is not None and expiry - time.time() <= min_validity:
+                self.cache.invalidate(cache_key)
+
+        async def fetch():
+            func = functools.partial(ydl.extract_info, url, download=False)
+            info = await loop.run_in_executor(self.executor, func)
+            if "entries" in info:
+                info = info["entries"][0]
+            return info
+
+        return ydl, await self.cache.get_or_fetch(cache_key, fetch)
+
+    def stats(self):
+        return self.cache.stats()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+extractor = Extractor()
+
+
+async def extract_info(
+    loop, url, *, ytdl_options=None, use_avconv=False, min_validity=0
+):
+    """|coro|
+    Runs ``youtube_dl`` extraction for ``url`` in a thread, and returns
+    the ``YoutubeDL`` instance and the info dict for the first entry.
+    Recent results are reused while their stream URL is good for at least
+    ``min_validity`` more seconds.
+    """
+    opts = {
+        "format": DEFAULT_FORMAT,
+        "prefer_ffmpeg": not use_avconv,
+        # A video linked from a playlist is just that video; whole
+        # playlists go through iter_playlist.
+        "noplaylist": True,
+    }
 
     if ytdl_options is not None and isinstance(ytdl_options, dict):
         opts.update(ytdl_options)
 
-    ydl = youtube_dl.YoutubeDL(opts)
-    func = functools.partial(ydl.extract_info, url, download=False)
-    info = await voice.loop.run_in_executor(None, func)
-    if "entries" in info:
-        info = info["entries"][0]
+    return await extractor.extract(loop, url, opts, min_validity)
+
+
+def is_playlist(url):
+    """
+    Whether ``url`` is a YouTube playlist, rather than a single video.
+    """
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    return "list" in query and (
+        "v" not in query or parsed.path.rstrip("/").endswith("/playlist")
+    )
+
+
+def _entry_url(entry):
+    url = entry.get("webpage_url") or entry.get("url")
+    if url and not url.startswith(("http://", "https://")):
+        if entry.get("ie_key") == "Youtube":
+            url = f"https://www.youtube.com/watch?v={url}"
+        else:
+            url = None
+    return url
 
+
+async def iter_playlist(loop, url, *, page_size=PLAYLIST_PAGE_SIZE):
+    """
+    Yield the URLs of the entries in playlist ``url``, without resolving
+    their streams. Entries are listed a page at a time as they're needed,
+    so only one page is held in memory however long the playlist is.
+    """
+    start = 1
+    while True:
+        ydl = youtube_dl.YoutubeDL({
+            "extract_flat": "in_playlist",
+            "playliststart": start,
+            "playlistend": start + page_size - 1,
+            "quiet": True,
+        })
+        func = functools.partial(ydl.extract_info, url, download=False)
+        info = await loop.run_in_executor(extractor.executor, func)
+        entries = list(info.get("entries") or [])
+        for entry in entries:
+            entry_url = entry and _entry_url(entry)
+            if entry_url:
+                yield entry_url
+        if len(entries) < page_size:
+            return
+        start += page_size
+
+
+def stream_url_expiry(info):
+    """
+    When the signed stream URL in ``info`` stops working, as a Unix
+    timestamp, or ``None`` if it doesn't say.
+    """
+    url = info.get("url", "")
+    expire = parse_qs(urlparse(url).query).get("expire", [None])[0]
+    if expire is None:
+        # Some hosts put it in the path instead: .../expire/1600000000/...
+        match = re.search(r"/expire/(\d+)", url)
+        expire = match and match.group(1)
+    try:
+        return float(expire) if expire else None
+    except ValueError:
+        return None
+
+
+def create_source(ydl, url, info, cached_path=None, volume=1.0):
+    """
+    Build an audio source for already-extracted ``info``, augmented with
+    the attributes described in :func:`create_ytdl_source`. If the track
+    is in the audio cache, ``cached_path`` is played instead of the
+    stream.
+    """
     print("playing URL {}".format(url))
     download_url = info["url"]
-    source = discord.FFmpegPCMAudio(download_url)
-    if source.is_opus():
-        print("Cannot enable volume, source is Opus")
+    if cached_path is not None:
+        source = CachedOpusSource(cached_path, volume, audio_cache.gain)
     else:
-        # Wrap in volume-adjuster:
-        source = discord.PCMVolumeTransformer(source)
+        source = discord.FFmpegPCMAudio(download_url)
+        if source.is_opus():
+            print("Cannot enable volume, source is Opus")
+        else:
+            # Wrap in volume-adjuster:
+            source = discord.PCMVolumeTransformer(source, volume)
 
     # set the dynamic attributes from the info extraction
     source.download_url = download_url